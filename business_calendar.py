@@ -0,0 +1,65 @@
+import logging
+import threading
+from bisect import bisect_left
+from datetime import date as Date, timedelta
+
+from catalog import load_json_file
+
+logger = logging.getLogger(__name__)
+
+
+# ПРОИЗВОДСТВЕННЫЙ КАЛЕНДАРЬ
+# Для каждого года один раз строится отсортированный список порядковых номеров рабочих дней:
+# будни без праздников плюс рабочие субботы по переносам. Поиск следующего рабочего дня — бинарный поиск
+class BusinessCalendar:
+    def __init__(self, holidays_file):
+        self.lock = threading.Lock()
+        self.years = {}
+        data = load_json_file(holidays_file)
+        if data is None:
+            logger.warning("Производственный календарь не загружен, выходными считаются только суббота и воскресенье")
+            data = {}
+        self.holidays = frozenset(Date.fromisoformat(day) for day in data.get('holidays', []))
+        self.workdays = frozenset(Date.fromisoformat(day) for day in data.get('workdays', []))
+        self.covered_years = frozenset(day.year for day in self.holidays | self.workdays)
+
+    def _year(self, year):
+        workdays = self.years.get(year)
+        if workdays is None:
+            with self.lock:
+                workdays = self.years.get(year)
+                if workdays is None:
+                    # Список строится один раз на год, поэтому и предупреждение выводится один раз
+                    if self.covered_years and year not in self.covered_years:
+                        logger.warning(f"Производственный календарь не содержит {year} год, "
+                                       f"выходными считаются только суббота и воскресенье")
+                    start = Date(year, 1, 1).toordinal()
+                    end = Date(year + 1, 1, 1).toordinal()
+                    workdays = [
+                        ordinal for ordinal in range(start, end)
+                        if self._is_workday(Date.fromordinal(ordinal))
+                    ]
+                    self.years[year] = workdays
+        return workdays
+
+    def _is_workday(self, day):
+        if day in self.workdays:
+            return True
+        return day.weekday() < 5 and day not in self.holidays
+
+    def is_workday(self, date):
+        ordinal = date.toordinal()
+        workdays = self._year(date.year)
+        index = bisect_left(workdays, ordinal)
+        return index < len(workdays) and workdays[index] == ordinal
+
+    # Ближайший рабочий день начиная с date включительно; время суток и часовой пояс сохраняются
+    def next_workday(self, date):
+        ordinal = date.toordinal()
+        year = date.year
+        while True:
+            workdays = self._year(year)
+            index = bisect_left(workdays, ordinal)
+            if index < len(workdays):
+                return date + timedelta(days=workdays[index] - ordinal)
+            year += 1
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left
+from types import MappingProxyType
+from typing import NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Specialist(NamedTuple):
+    surname: str
+    projects: Tuple[str, ...]
+
+
+class Task(NamedTuple):
+    task: str
+    interval_days: int
+
+
+# ЗАГРУЗКА JSON ФАЙЛА
+def load_json_file(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        logger.error(f"Файл {file_path} не найден.")
+        return None
+    except json.JSONDecodeError:
+        logger.error(f"Ошибка при разборе JSON в файле {file_path}.")
+        return None
+
+
+# НЕИЗМЕНЯЕМЫЙ СНИМОК СПРАВОЧНИКОВ СПЕЦИАЛИСТОВ И ЗАДАЧ
+class Catalog:
+    def __init__(self, specialists, tasks, version):
+        self.specialists = tuple(sorted(specialists, key=lambda s: s.surname))
+        self.by_surname = MappingProxyType({s.surname: s for s in self.specialists})
+        # Группы по первой букве фамилии для постраничной клавиатуры
+        by_letter = {}
+        for specialist in self.specialists:
+            by_letter.setdefault(specialist.surname[:1].upper(), []).append(specialist)
+        self.by_letter = MappingProxyType({letter: tuple(group) for letter, group in by_letter.items()})
+        # Отсортированный индекс фамилий в нижнем регистре: совпадения по префиксу идут подряд
+        self.prefix_index = sorted((s.surname.lower(), s.surname) for s in self.specialists)
+        self.tasks = tuple(tasks)
+        self.version = version
+
+    @classmethod
+    def from_files(cls, specialists_file, tasks_file, version):
+        specialists_data = load_json_file(specialists_file)
+        tasks_data = load_json_file(tasks_file)
+        if specialists_data is None or tasks_data is None:
+            return None
+        specialists = [Specialist(s['surname'], tuple(s['projects'])) for s in specialists_data['specialists']]
+        tasks = [Task(t['task'], t['interval_days']) for t in tasks_data['tasks']]
+        return cls(specialists, tasks, version)
+
+    # Поиск специалистов по началу фамилии
+    def search(self, prefix, offset=0, limit=20):
+        prefix = prefix.strip().lower()
+        start = bisect_left(self.prefix_index, (prefix,)) + offset
+        found = []
+        for key, surname in self.prefix_index[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            found.append(self.by_surname[surname])
+        return found
+
+
+# ХРАНИЛИЩЕ ТЕКУЩЕГО СПРАВОЧНИКА С ПЕРЕЗАГРУЗКОЙ ПРИ ИЗМЕНЕНИИ ФАЙЛОВ
+# Обработчики читают только current; файлы проверяет фоновая задача через reload_if_changed
+class CatalogStore:
+    def __init__(self, specialists_file, tasks_file):
+        self.specialists_file = specialists_file
+        self.tasks_file = tasks_file
+        self.lock = threading.Lock()
+        self.mtimes = None
+        self.catalog = None
+
+    def _mtimes(self):
+        try:
+            return os.stat(self.specialists_file).st_mtime_ns, os.stat(self.tasks_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @property
+    def current(self):
+        if self.catalog is None:
+            self.reload_if_changed()
+        return self.catalog
+
+    # Возвращает True, если справочник был перечитан
+    def reload_if_changed(self):
+        with self.lock:
+            mtimes = self._mtimes()
+            if mtimes is not None and mtimes == self.mtimes:
+                return False
+            version = self.catalog.version + 1 if self.catalog is not None else 1
+            catalog = Catalog.from_files(self.specialists_file, self.tasks_file, version)
+            self.mtimes = mtimes
+            if catalog is None:
+                # Битый или отсутствующий файл: продолжаем работать со старым снимком до следующего изменения
+                if self.catalog is None:
+                    self.catalog = Catalog((), (), 0)
+                return False
+            # Замена ссылки атомарна: читатели видят либо старый, либо новый снимок целиком
+            self.catalog = catalog
+        logger.info(f"Справочники загружены: специалистов {len(catalog.specialists)}, задач {len(catalog.tasks)}, "
+                    f"версия {catalog.version}")
+        return True
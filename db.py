@@ -0,0 +1,571 @@
+import asyncio
+import functools
+import logging
+import os
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from metrics import Histogram
+from migrations import MIGRATIONS, POSTGRES_MIGRATIONS, migrate
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv('DB_PATH', 'tasks.db')
+# Строка подключения к PostgreSQL (postgres://...); без неё используется локальный SQLite
+DATABASE_URL = os.getenv('DATABASE_URL')
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 4))
+# Размер кэша подготовленных выражений на одно соединение
+STATEMENT_CACHE_SIZE = 256
+# Ключ рекомендательной блокировки PostgreSQL на время миграций
+MIGRATION_LOCK_ID = 7001
+
+DB_QUERY_SECONDS = Histogram('db_query_seconds', 'Время выполнения операции с базой данных, включая ожидание соединения',
+                             ['operation'])
+
+
+# ПРЕОБРАЗОВАНИЕ ДАТ ДЛЯ ХРАНЕНИЯ
+# Даты хранятся в UTC: строки ISO 8601 с одинаковым смещением сравниваются как время
+def to_db(date):
+    return date.astimezone(timezone.utc).isoformat() if date is not None else None
+
+
+def from_db(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+# ВЫБОР ХРАНИЛИЩА ПО ПЕРЕМЕННЫМ ОКРУЖЕНИЯ
+def create_database():
+    if DATABASE_URL:
+        return PostgresDatabase(DATABASE_URL)
+    return SqliteDatabase(DB_PATH)
+
+
+# ХРАНИЛИЩЕ ЗАДАЧ, ПОЛЬЗОВАТЕЛЕЙ И ЖУРНАЛА ОТПРАВОК
+# Запросы общие для всех бэкендов (параметры через «?», вставки через ON CONFLICT),
+# подклассы отвечают только за пул соединений и миграции своей СУБД
+class Database:
+    migrations = MIGRATIONS
+    begin_statement = "BEGIN"
+
+    def __init__(self, pool_size=POOL_SIZE):
+        self.pool_size = pool_size
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='db')
+
+    # Контекстный менеджер, выдающий соединение из пула: фиксирует транзакцию при выходе,
+    # откатывает при исключении
+    def connection(self):
+        raise NotImplementedError
+
+    def _close_pool(self):
+        raise NotImplementedError
+
+    # СИНХРОННЫЙ ВЫЗОВ (ДЛЯ ЗАПУСКА И ФОНОВЫХ ПОТОКОВ)
+    def call(self, fn, *args):
+        with DB_QUERY_SECONDS.time(operation=fn.__name__.lstrip('_')), self.connection() as conn:
+            return fn(conn.cursor(), *args)
+
+    # ВЫЗОВ В ПУЛЕ ПОТОКОВ, ЧТОБЫ МЕДЛЕННЫЙ ДИСК НЕ БЛОКИРОВАЛ ОБРАБОТКУ ОБНОВЛЕНИЙ
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self.call, fn, *args))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self._close_pool()
+
+    def migrate(self):
+        with self.connection() as conn:
+            return migrate(conn, self.migrations, self.begin_statement)
+
+    # ЗАДАЧИ
+    # Функции расписания получают настройки чата (часовой пояс, начало и конец окна отправки):
+    # schedule(start, days, settings) — дата напоминания через days дней после start,
+    # clamp(date, settings) — ближайшее к date время внутри окна чата
+
+    async def seed_tasks(self, chat_id, projects, tasks, schedule, now):
+        return await self.run(self._seed_tasks, chat_id, projects, tasks, schedule, now)
+
+    @staticmethod
+    def _seed_tasks(c, chat_id, projects, tasks, schedule, now):
+        c.execute("SELECT timezone, window_start, window_end FROM chats WHERE chat_id = ?", (chat_id,))
+        settings = c.fetchone()
+        projects = list(dict.fromkeys(projects))
+        project_ids = {}
+        if projects:
+            placeholders = ','.join('?' for _ in projects)
+            c.execute(f"SELECT name, id FROM projects WHERE name IN ({placeholders})", projects)
+            project_ids = dict(c.fetchall())
+        # Строки проектов, которые больше не закреплены за специалистом.
+        # Без проектов удаляются все строки чата: пустой список IN () не поддерживает PostgreSQL
+        if project_ids:
+            placeholders = ','.join('?' for _ in project_ids)
+            c.execute(f"DELETE FROM tasks WHERE chat_id = ? AND project_id NOT IN ({placeholders})",
+                      (chat_id, *project_ids.values()))
+        else:
+            c.execute("DELETE FROM tasks WHERE chat_id = ?", (chat_id,))
+        removed = c.rowcount
+        c.execute("SELECT project_id, task FROM tasks WHERE chat_id = ?", (chat_id,))
+        existing = set(c.fetchall())
+        rows = [
+            (chat_id, project_id, task, interval, to_db(schedule(now, interval, settings)))
+            for task, interval in tasks
+            for project_id in project_ids.values()
+            if (project_id, task) not in existing
+        ]
+        c.executemany(
+            """
+            INSERT INTO tasks (chat_id, project_id, task, "interval", next_reminder) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (chat_id, project_id, task) DO NOTHING
+            """,
+            rows
+        )
+        return len(rows), removed
+
+    async def nearest_task(self, chat_id):
+        return await self.run(self._nearest_task, chat_id)
+
+    @staticmethod
+    def _nearest_task(c, chat_id):
+        c.execute("""
+            SELECT t.task, t.next_reminder, t."interval", ch.timezone
+            FROM tasks t
+            JOIN chats ch ON ch.chat_id = t.chat_id
+            WHERE t.chat_id = ?
+            ORDER BY t.next_reminder ASC
+            LIMIT 1
+        """, (chat_id,))
+        row = c.fetchone()
+        if row is None:
+            return None
+        task, next_reminder, interval, timezone_name = row
+        return task, from_db(next_reminder), interval, timezone_name
+
+    async def due_tasks(self, now):
+        return await self.run(self._due_tasks, now)
+
+    # Даты напоминаний хранятся уже приведёнными к окну отправки своего чата,
+    # поэтому сюда попадают только чаты, у которых окно открыто.
+    # CROSS JOIN фиксирует порядок соединения в SQLite: обход активных чатов по частичному индексу
+    # и поиск их просроченных задач по (chat_id, next_reminder), без просмотра строк отключённых чатов
+    @staticmethod
+    def _due_tasks(c, now):
+        c.execute(
+            """
+            SELECT t.id, t.chat_id, p.name, t.task, t."interval", ch.digest, ch.timezone, ch.window_start, ch.window_end
+            FROM chats ch
+            CROSS JOIN tasks t
+            JOIN projects p ON p.id = t.project_id
+            WHERE ch.active = 1 AND t.chat_id = ch.chat_id AND t.next_reminder <= ?
+            """,
+            (to_db(now),)
+        )
+        return c.fetchall()
+
+    # Даты напоминаний активных чатов для очереди в памяти: всех или одного
+    async def reminder_schedule(self, chat_id=None):
+        return await self.run(self._reminder_schedule, chat_id)
+
+    @staticmethod
+    def _reminder_schedule(c, chat_id):
+        sql = """
+            SELECT t.id, t.chat_id, t.next_reminder
+            FROM chats ch
+            JOIN tasks t ON t.chat_id = ch.chat_id
+            WHERE ch.active = 1
+        """
+        if chat_id is None:
+            c.execute(sql)
+        else:
+            c.execute(sql + " AND ch.chat_id = ?", (chat_id,))
+        return [(task_id, chat, from_db(next_reminder)) for task_id, chat, next_reminder in c.fetchall()]
+
+    # Журнал отправок и перенос отправленных напоминаний одной транзакцией
+    async def record_deliveries(self, log_rows, advanced):
+        return await self.run(self._record_deliveries, log_rows, advanced)
+
+    @staticmethod
+    def _record_deliveries(c, log_rows, advanced):
+        c.executemany(
+            "INSERT INTO sent_reminders (chat_id, task, sent_at, status, error) VALUES (?, ?, ?, ?, ?)",
+            [(chat_id, task, to_db(sent_at), status, error) for chat_id, task, sent_at, status, error in log_rows]
+        )
+        c.executemany("UPDATE tasks SET next_reminder = ? WHERE id = ?",
+                      [(to_db(next_reminder), task_id) for next_reminder, task_id in advanced])
+
+    # ЧАТЫ
+
+    # Чат, вернувшийся после /stop или разблокировки, получает просроченные напоминания заново от now,
+    # а не все разом сразу после регистрации
+    async def save_chat(self, chat_id, surname, projects, schedule, now):
+        return await self.run(self._save_chat, chat_id, surname, projects, schedule, now)
+
+    @staticmethod
+    def _save_chat(c, chat_id, surname, projects, schedule, now):
+        c.execute("SELECT active FROM chats WHERE chat_id = ?", (chat_id,))
+        previous = c.fetchone()
+        c.execute("INSERT INTO specialists (surname) VALUES (?) ON CONFLICT (surname) DO NOTHING", (surname,))
+        c.execute("SELECT id FROM specialists WHERE surname = ?", (surname,))
+        specialist_id = c.fetchone()[0]
+        c.executemany("INSERT INTO projects (name) VALUES (?) ON CONFLICT (name) DO NOTHING",
+                      [(project,) for project in projects])
+        placeholders = ','.join('?' for _ in projects)
+        c.execute(f"""
+            INSERT INTO assignments (specialist_id, project_id)
+            SELECT ?, p.id FROM projects p WHERE p.name IN ({placeholders})
+            ON CONFLICT (specialist_id, project_id) DO NOTHING
+        """, (specialist_id, *projects))
+        c.execute(
+            """
+            INSERT INTO chats (chat_id, specialist_id, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (chat_id) DO UPDATE SET specialist_id = excluded.specialist_id, updated_at = excluded.updated_at,
+                active = 1
+            """,
+            (chat_id, specialist_id, to_db(now))
+        )
+        if previous is None or previous[0]:
+            return
+        c.execute(
+            """
+            SELECT t.id, t."interval", ch.timezone, ch.window_start, ch.window_end
+            FROM tasks t
+            JOIN chats ch ON ch.chat_id = t.chat_id
+            WHERE t.chat_id = ? AND t.next_reminder <= ?
+            """,
+            (chat_id, to_db(now))
+        )
+        c.executemany(
+            "UPDATE tasks SET next_reminder = ? WHERE id = ?",
+            [(to_db(schedule(now, interval, settings)), task_id) for task_id, interval, *settings in c.fetchall()]
+        )
+
+    # Включение и выключение режима сводки; False, если чат не зарегистрирован
+    async def set_chat_digest(self, chat_id, enabled):
+        return await self.run(self._set_chat_digest, chat_id, enabled)
+
+    @staticmethod
+    def _set_chat_digest(c, chat_id, enabled):
+        c.execute("UPDATE chats SET digest = ? WHERE chat_id = ?", (int(enabled), chat_id))
+        return c.rowcount > 0
+
+    # Отключение чатов: расписание сохраняется и снова используется после /start
+    async def deactivate_chats(self, chat_ids, now):
+        return await self.run(self._deactivate_chats, chat_ids, now)
+
+    @staticmethod
+    def _deactivate_chats(c, chat_ids, now):
+        c.executemany("UPDATE chats SET active = 0, updated_at = ? WHERE chat_id = ?",
+                      [(to_db(now), chat_id) for chat_id in chat_ids])
+
+    # Меняет часовой пояс и/или окно отправки (None — оставить как есть) и переносит напоминания чата
+    # в новое окно. Возвращает новые настройки или None, если чат не зарегистрирован
+    async def update_chat_settings(self, chat_id, timezone_name, window_start, window_end, clamp):
+        return await self.run(self._update_chat_settings, chat_id, timezone_name, window_start, window_end, clamp)
+
+    @staticmethod
+    def _update_chat_settings(c, chat_id, timezone_name, window_start, window_end, clamp):
+        c.execute(
+            """
+            UPDATE chats SET timezone = COALESCE(?, timezone), window_start = COALESCE(?, window_start),
+                window_end = COALESCE(?, window_end)
+            WHERE chat_id = ?
+            """,
+            (timezone_name, window_start, window_end, chat_id)
+        )
+        if c.rowcount == 0:
+            return None
+        c.execute("SELECT timezone, window_start, window_end FROM chats WHERE chat_id = ?", (chat_id,))
+        settings = c.fetchone()
+        c.execute("SELECT id, next_reminder FROM tasks WHERE chat_id = ?", (chat_id,))
+        c.executemany("UPDATE tasks SET next_reminder = ? WHERE id = ?", [
+            (to_db(clamp(from_db(next_reminder), settings)), task_id) for task_id, next_reminder in c.fetchall()
+        ])
+        return settings
+
+    # СИНХРОНИЗАЦИЯ СО СПРАВОЧНИКАМИ
+
+    # Применяет к расписанию только разницу между справочником и базой одной транзакцией
+    async def sync_catalog(self, specialists, tasks, schedule, now):
+        return await self.run(self._sync_catalog, specialists, tasks, schedule, now)
+
+    @staticmethod
+    def _sync_catalog(c, specialists, tasks, schedule, now):
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS catalog_assignments (surname TEXT NOT NULL, project TEXT NOT NULL)")
+        c.execute('CREATE TEMP TABLE IF NOT EXISTS catalog_tasks (task TEXT NOT NULL, "interval" INTEGER NOT NULL)')
+        c.execute("DELETE FROM catalog_assignments")
+        c.execute("DELETE FROM catalog_tasks")
+        c.executemany("INSERT INTO catalog_assignments (surname, project) VALUES (?, ?)",
+                      [(s.surname, project) for s in specialists for project in s.projects])
+        c.executemany('INSERT INTO catalog_tasks (task, "interval") VALUES (?, ?)',
+                      [(t.task, t.interval_days) for t in tasks])
+
+        c.executemany("INSERT INTO specialists (surname) VALUES (?) ON CONFLICT (surname) DO NOTHING",
+                      [(s.surname,) for s in specialists])
+        c.execute("""
+            INSERT INTO projects (name) SELECT DISTINCT project FROM catalog_assignments WHERE true
+            ON CONFLICT (name) DO NOTHING
+        """)
+        c.execute("""
+            DELETE FROM assignments WHERE NOT EXISTS (
+                SELECT 1 FROM catalog_assignments ca
+                JOIN specialists s ON s.surname = ca.surname
+                JOIN projects p ON p.name = ca.project
+                WHERE s.id = assignments.specialist_id AND p.id = assignments.project_id
+            )
+        """)
+        c.execute("""
+            INSERT INTO assignments (specialist_id, project_id)
+            SELECT s.id, p.id
+            FROM catalog_assignments ca
+            JOIN specialists s ON s.surname = ca.surname
+            JOIN projects p ON p.name = ca.project
+            WHERE true
+            ON CONFLICT (specialist_id, project_id) DO NOTHING
+        """)
+
+        # Строки проектов, снятых со специалиста, и задач, удалённых из справочника
+        c.execute("""
+            DELETE FROM tasks
+            WHERE NOT EXISTS (
+                SELECT 1 FROM chats ch JOIN assignments a ON a.specialist_id = ch.specialist_id
+                WHERE ch.chat_id = tasks.chat_id AND a.project_id = tasks.project_id
+            )
+            OR NOT EXISTS (SELECT 1 FROM catalog_tasks ct WHERE ct.task = tasks.task)
+        """)
+        removed = c.rowcount
+
+        # Смена интервала: следующее напоминание считается от предыдущего срока по новому интервалу
+        c.execute("""
+            SELECT t.id, t."interval", t.next_reminder, ct."interval", ch.timezone, ch.window_start, ch.window_end
+            FROM tasks t
+            JOIN catalog_tasks ct ON ct.task = t.task
+            JOIN chats ch ON ch.chat_id = t.chat_id
+            WHERE t."interval" <> ct."interval"
+        """)
+        changed = [
+            (new_interval, to_db(schedule(from_db(next_reminder) - timedelta(days=old_interval), new_interval,
+                                          settings)), task_id)
+            for task_id, old_interval, next_reminder, new_interval, *settings in c.fetchall()
+        ]
+        c.executemany('UPDATE tasks SET "interval" = ?, next_reminder = ? WHERE id = ?', changed)
+
+        # Дата первого напоминания зависит от окна чата, поэтому недостающие строки считаются здесь
+        c.execute("""
+            SELECT ch.chat_id, a.project_id, ct.task, ct."interval", ch.timezone, ch.window_start, ch.window_end
+            FROM chats ch
+            JOIN assignments a ON a.specialist_id = ch.specialist_id
+            CROSS JOIN catalog_tasks ct
+            WHERE ch.active = 1 AND NOT EXISTS (
+                SELECT 1 FROM tasks t
+                WHERE t.chat_id = ch.chat_id AND t.project_id = a.project_id AND t.task = ct.task
+            )
+        """)
+        added = [
+            (chat_id, project_id, task, interval, to_db(schedule(now, interval, settings)))
+            for chat_id, project_id, task, interval, *settings in c.fetchall()
+        ]
+        c.executemany(
+            """
+            INSERT INTO tasks (chat_id, project_id, task, "interval", next_reminder) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (chat_id, project_id, task) DO NOTHING
+            """,
+            added
+        )
+        return len(added), removed, len(changed)
+
+    # ПОЛЬЗОВАТЕЛИ И ВЫГРУЗКА В GOOGLE SHEETS
+
+    # Возвращает True, если статус изменился и строка для Google Sheets поставлена в outbox
+    async def set_user_status(self, user_id, surname, status, now, sheet_row):
+        return await self.run(self._set_user_status, user_id, surname, status, now, sheet_row)
+
+    @staticmethod
+    def _set_user_status(c, user_id, surname, status, now, sheet_row):
+        c.execute("SELECT status FROM users WHERE id = ?", (user_id,))
+        old_status = c.fetchone()
+        if old_status is not None and old_status[0] == status:
+            return False
+        c.execute(
+            """
+            INSERT INTO users (id, surname, status, last_update) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET surname = excluded.surname, status = excluded.status,
+                last_update = excluded.last_update
+            """,
+            (user_id, surname, status, to_db(now))
+        )
+        queued_at = to_db(datetime.now(timezone.utc))
+        c.execute(
+            """
+            INSERT INTO sheets_outbox (specialist, status, date_on, date_off, created_at, next_attempt)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (*sheet_row, queued_at, queued_at)
+        )
+        return True
+
+    async def outbox_batch(self, now, limit):
+        return await self.run(self._outbox_batch, now, limit)
+
+    @staticmethod
+    def _outbox_batch(c, now, limit):
+        c.execute(
+            """
+            SELECT id, specialist, status, date_on, date_off, attempts
+            FROM sheets_outbox
+            WHERE next_attempt <= ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (to_db(now), limit)
+        )
+        rows = c.fetchall()
+        c.execute("SELECT MIN(next_attempt), COUNT(*) FROM sheets_outbox")
+        nearest, depth = c.fetchone()
+        return rows, from_db(nearest), depth
+
+    async def outbox_sent(self, ids):
+        return await self.run(self._outbox_sent, ids)
+
+    @staticmethod
+    def _outbox_sent(c, ids):
+        c.executemany("DELETE FROM sheets_outbox WHERE id = ?", [(row_id,) for row_id in ids])
+
+    async def outbox_retry(self, retries):
+        return await self.run(self._outbox_retry, retries)
+
+    @staticmethod
+    def _outbox_retry(c, retries):
+        c.executemany(
+            "UPDATE sheets_outbox SET attempts = ?, next_attempt = ? WHERE id = ?",
+            [(attempts, to_db(next_attempt), row_id) for row_id, attempts, next_attempt in retries]
+        )
+
+    async def outbox_failed(self, ids, error, now):
+        return await self.run(self._outbox_failed, ids, error, now)
+
+    @staticmethod
+    def _outbox_failed(c, ids, error, now):
+        c.executemany(
+            """
+            INSERT INTO sheets_outbox_failed
+                (id, specialist, status, date_on, date_off, created_at, attempts, failed_at, error)
+            SELECT id, specialist, status, date_on, date_off, created_at, attempts + 1, ?, ?
+            FROM sheets_outbox WHERE id = ?
+            """,
+            [(to_db(now), error, row_id) for row_id in ids]
+        )
+        c.executemany("DELETE FROM sheets_outbox WHERE id = ?", [(row_id,) for row_id in ids])
+
+
+# ЛОКАЛЬНЫЙ SQLITE: WAL, ПУЛ ПЕРЕИСПОЛЬЗУЕМЫХ СОЕДИНЕНИЙ
+class SqliteDatabase(Database):
+    def __init__(self, path=DB_PATH, pool_size=POOL_SIZE):
+        super().__init__(pool_size)
+        self.path = path
+        self.pool = queue.LifoQueue()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            if self.pool.qsize() < self.pool_size:
+                self.pool.put(conn)
+            else:
+                conn.close()
+
+    def _close_pool(self):
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+
+# КУРСОР POSTGRESQL С ПАРАМЕТРАМИ В СТИЛЕ SQLITE
+class PostgresCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @staticmethod
+    def _sql(sql):
+        return sql.replace('%', '%%').replace('?', '%s')
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(self._sql(sql), tuple(params))
+
+    def executemany(self, sql, rows):
+        from psycopg2.extras import execute_batch
+        execute_batch(self.cursor, self._sql(sql), list(rows))
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+
+class PostgresConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return PostgresCursor(self.conn.cursor())
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+
+# POSTGRESQL: ВНЕШНЯЯ БАЗА ВМЕСТО ЛОКАЛЬНОГО ФАЙЛА
+# Пул psycopg2 используется из того же пула потоков, что и SQLite, поэтому цикл событий не блокируется.
+# Поддерживается только один процесс бота на базу: очередь напоминаний, проверка и выгрузка outbox
+# живут в памяти процесса и не захватывают строки, поэтому вторая реплика отправит всё повторно
+class PostgresDatabase(Database):
+    migrations = POSTGRES_MIGRATIONS
+    # psycopg2 сам открывает транзакцию перед первой командой
+    begin_statement = None
+
+    def __init__(self, dsn, pool_size=POOL_SIZE):
+        super().__init__(pool_size)
+        from psycopg2.pool import ThreadedConnectionPool
+        self.pool = ThreadedConnectionPool(1, pool_size, dsn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.getconn()
+        try:
+            with conn:
+                yield PostgresConnection(conn)
+        finally:
+            self.pool.putconn(conn)
+
+    def _close_pool(self):
+        self.pool.closeall()
+
+    # Перекрывающиеся запуски (например, при деплое) применяют миграции по очереди
+    def migrate(self):
+        with self.connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT pg_advisory_lock(?)", (MIGRATION_LOCK_ID,))
+            try:
+                return migrate(conn, self.migrations, self.begin_statement)
+            finally:
+                c.execute("SELECT pg_advisory_unlock(?)", (MIGRATION_LOCK_ID,))
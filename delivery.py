@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import time
+
+from telegram.error import Forbidden, RetryAfter
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: около 30 сообщений в секунду на бота и не больше одного в секунду в один чат
+GLOBAL_RATE = float(os.getenv('DELIVERY_GLOBAL_RATE', 30))
+CHAT_RATE = float(os.getenv('DELIVERY_CHAT_RATE', 1))
+MAX_CONCURRENCY = int(os.getenv('DELIVERY_CONCURRENCY', 20))
+MAX_RETRIES = 3
+
+SEND_SECONDS = Histogram('telegram_send_seconds', 'Время запроса sendMessage к Bot API')
+SENT_MESSAGES = Counter('telegram_sent_messages_total', 'Отправленные сообщения')
+SEND_FAILURES = Counter('telegram_send_failures_total', 'Сообщения, которые не удалось отправить, по типу ошибки',
+                        ['error'])
+
+
+# ОГРАНИЧИТЕЛЬ СКОРОСТИ «TOKEN BUCKET»
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # Замок создаётся в работающем цикле событий: в Python 3.9 он привязывается к циклу при создании
+        self.lock = None
+
+    async def acquire(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ОТПРАВКА СООБЩЕНИЙ С УЧЕТОМ ЛИМИТОВ TELEGRAM
+class Delivery:
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, concurrency=MAX_CONCURRENCY):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}
+        self.concurrency = concurrency
+        self.semaphore = None
+        self.resume_at = 0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    # Возвращает None при успехе или исключение, с которым отправка окончательно не удалась
+    async def send(self, bot, chat_id, text, **kwargs):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        for attempt in range(MAX_RETRIES + 1):
+            await self._chat_bucket(chat_id).acquire()
+            async with self.semaphore:
+                # После RetryAfter Telegram не принимает сообщения от бота целиком, поэтому пауза общая
+                pause = self.resume_at - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                await self.global_bucket.acquire()
+                try:
+                    with SEND_SECONDS.time():
+                        await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    SENT_MESSAGES.inc()
+                    return None
+                except RetryAfter as e:
+                    logger.warning(f"Превышен лимит Telegram при отправке в чат {chat_id}, пауза {e.retry_after} с")
+                    self.resume_at = max(self.resume_at, time.monotonic() + e.retry_after)
+                    if attempt == MAX_RETRIES:
+                        SEND_FAILURES.inc(error=type(e).__name__)
+                        return e
+                except Exception as e:
+                    SEND_FAILURES.inc(error=type(e).__name__)
+                    return e
+
+    # ОТПРАВКА ПАЧКИ СООБЩЕНИЙ: ПО ЧАТАМ ПАРАЛЛЕЛЬНО, ВНУТРИ ЧАТА ПО ПОРЯДКУ
+    async def send_many(self, bot, messages):
+        by_chat = {}
+        for index, (chat_id, text, kwargs) in enumerate(messages):
+            by_chat.setdefault(chat_id, []).append((index, text, kwargs))
+        results = [None] * len(messages)
+
+        async def send_chat(chat_id, items):
+            error = None
+            for index, text, kwargs in items:
+                # Заблокировавшему бота чату остальные сообщения не отправляем: ответ будет тем же
+                if not isinstance(error, Forbidden):
+                    error = await self.send(bot, chat_id, text, **kwargs)
+                results[index] = error
+
+        await asyncio.gather(*(send_chat(chat_id, items) for chat_id, items in by_chat.items()))
+        return results
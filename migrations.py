@@ -0,0 +1,354 @@
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# СПИСОК МИГРАЦИЙ СХЕМЫ
+# Каждая миграция — (версия, список SQL-команд). Уже применённые версии хранятся в schema_migrations,
+# поэтому новые изменения схемы добавляются только в конец списка со следующим номером версии.
+# Вместо SQL-команды можно указать функцию, принимающую курсор, — для преобразования данных.
+
+
+# Даты напоминаний хранились с московским смещением; для чатов в разных часовых поясах
+# строки сравниваются корректно, только если все они в UTC
+def convert_reminders_to_utc(c):
+    c.execute("SELECT id, next_reminder FROM tasks")
+    c.executemany(
+        "UPDATE tasks SET next_reminder = ? WHERE id = ?",
+        [
+            (datetime.fromisoformat(next_reminder).astimezone(timezone.utc).isoformat(), task_id)
+            for task_id, next_reminder in c.fetchall()
+        ]
+    )
+
+
+# Часовой пояс и окно отправки напоминаний для каждого чата
+CHAT_WINDOW_MIGRATION = [
+    "ALTER TABLE chats ADD COLUMN timezone TEXT NOT NULL DEFAULT 'Europe/Moscow'",
+    "ALTER TABLE chats ADD COLUMN window_start TEXT NOT NULL DEFAULT '10:00'",
+    "ALTER TABLE chats ADD COLUMN window_end TEXT NOT NULL DEFAULT '19:00'",
+    convert_reminders_to_utc,
+]
+
+# Отключённые чаты (/stop или бот заблокирован) остаются в базе, но не попадают в выборку напоминаний:
+# частичный индекс содержит только активные чаты
+CHAT_ACTIVE_MIGRATION = [
+    "ALTER TABLE chats ADD COLUMN active INTEGER NOT NULL DEFAULT 1",
+    "CREATE INDEX idx_chats_active ON chats(chat_id) WHERE active = 1",
+]
+
+# Режим сводки: все напоминания чата за одну проверку приходят одним сообщением
+CHAT_DIGEST_MIGRATION = [
+    "ALTER TABLE chats ADD COLUMN digest INTEGER NOT NULL DEFAULT 0",
+]
+
+# Записи, которые Google Sheets отклонил без права на повтор (400, 403), переносятся из outbox
+# вместе с текстом ошибки, чтобы не переотправлять их бесконечно
+SHEETS_OUTBOX_FAILED_MIGRATION = [
+    '''
+    CREATE TABLE sheets_outbox_failed (
+        id BIGINT PRIMARY KEY,
+        specialist TEXT NOT NULL,
+        status TEXT NOT NULL,
+        date_on TEXT,
+        date_off TEXT,
+        created_at TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        failed_at TEXT NOT NULL,
+        error TEXT
+    )
+    ''',
+]
+
+MIGRATIONS = [
+    (1, [
+        '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            project TEXT,
+            task TEXT,
+            interval INTEGER,
+            next_reminder TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sent_reminders (
+            task_id INTEGER PRIMARY KEY,
+            sent_at TEXT,
+            responded BOOLEAN
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            surname TEXT,
+            status TEXT,
+            last_update TEXT
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_tasks_next_reminder ON tasks(next_reminder)",
+        "CREATE INDEX IF NOT EXISTS idx_sent_reminders_task_id ON sent_reminders(task_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_status ON users(status)",
+    ]),
+    (2, [
+        '''
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            surname TEXT NOT NULL,
+            updated_at TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS chat_projects (
+            chat_id INTEGER NOT NULL,
+            project TEXT NOT NULL,
+            PRIMARY KEY (chat_id, project)
+        )
+        ''',
+    ]),
+    # Нормализованная схема: специалисты, проекты, назначения и собственные строки расписания у каждого чата
+    (3, [
+        '''
+        CREATE TABLE specialists (
+            id INTEGER PRIMARY KEY,
+            surname TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TABLE projects (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TABLE assignments (
+            specialist_id INTEGER NOT NULL REFERENCES specialists(id),
+            project_id INTEGER NOT NULL REFERENCES projects(id),
+            PRIMARY KEY (specialist_id, project_id)
+        )
+        ''',
+        "INSERT OR IGNORE INTO specialists (surname) SELECT DISTINCT surname FROM chats",
+        "INSERT OR IGNORE INTO projects (name) SELECT DISTINCT project FROM chat_projects",
+        '''
+        INSERT OR IGNORE INTO assignments (specialist_id, project_id)
+        SELECT s.id, p.id
+        FROM chats ch
+        JOIN specialists s ON s.surname = ch.surname
+        JOIN chat_projects cp ON cp.chat_id = ch.chat_id
+        JOIN projects p ON p.name = cp.project
+        ''',
+        '''
+        CREATE TABLE chats_new (
+            chat_id INTEGER PRIMARY KEY,
+            specialist_id INTEGER NOT NULL REFERENCES specialists(id),
+            updated_at TEXT
+        )
+        ''',
+        '''
+        INSERT INTO chats_new (chat_id, specialist_id, updated_at)
+        SELECT ch.chat_id, s.id, ch.updated_at
+        FROM chats ch
+        JOIN specialists s ON s.surname = ch.surname
+        ''',
+        '''
+        CREATE TABLE tasks_new (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL REFERENCES chats(chat_id),
+            project_id INTEGER NOT NULL REFERENCES projects(id),
+            task TEXT NOT NULL,
+            interval INTEGER NOT NULL,
+            next_reminder TEXT NOT NULL
+        )
+        ''',
+        '''
+        INSERT INTO tasks_new (chat_id, project_id, task, interval, next_reminder)
+        SELECT cp.chat_id, p.id, t.task, MAX(t.interval), MIN(t.next_reminder)
+        FROM tasks t
+        JOIN chat_projects cp ON cp.project = t.project
+        JOIN projects p ON p.name = t.project
+        GROUP BY cp.chat_id, p.id, t.task
+        ''',
+        "DROP TABLE chat_projects",
+        "DROP TABLE chats",
+        "ALTER TABLE chats_new RENAME TO chats",
+        "DROP TABLE tasks",
+        "ALTER TABLE tasks_new RENAME TO tasks",
+        "CREATE INDEX idx_tasks_next_reminder ON tasks(next_reminder)",
+        "CREATE INDEX idx_tasks_chat_next_reminder ON tasks(chat_id, next_reminder)",
+        "CREATE INDEX idx_assignments_project ON assignments(project_id)",
+        "CREATE INDEX idx_chats_specialist ON chats(specialist_id)",
+    ]),
+    # Удаление дублей, накопленных повторной регистрацией, и уникальный ключ для идемпотентного заполнения
+    (4, [
+        '''
+        DELETE FROM tasks
+        WHERE id NOT IN (SELECT MIN(id) FROM tasks GROUP BY chat_id, project_id, task)
+        ''',
+        "CREATE UNIQUE INDEX ux_tasks_chat_project_task ON tasks(chat_id, project_id, task)",
+    ]),
+    # Очередь выгрузки статусов в Google Sheets, переживающая перезапуски и сбои API
+    (5, [
+        '''
+        CREATE TABLE sheets_outbox (
+            id INTEGER PRIMARY KEY,
+            specialist TEXT NOT NULL,
+            status TEXT NOT NULL,
+            date_on TEXT,
+            date_off TEXT,
+            created_at TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX idx_sheets_outbox_next_attempt ON sheets_outbox(next_attempt)",
+    ]),
+    # Журнал отправок: старая таблица sent_reminders никогда не заполнялась
+    (6, [
+        "DROP TABLE IF EXISTS sent_reminders",
+        '''
+        CREATE TABLE sent_reminders (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            task TEXT NOT NULL,
+            sent_at TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT
+        )
+        ''',
+        "CREATE INDEX idx_sent_reminders_chat_sent_at ON sent_reminders(chat_id, sent_at)",
+    ]),
+    (7, CHAT_WINDOW_MIGRATION),
+    (8, CHAT_ACTIVE_MIGRATION),
+    (9, CHAT_DIGEST_MIGRATION),
+    (10, SHEETS_OUTBOX_FAILED_MIGRATION),
+]
+
+
+# СХЕМА POSTGRESQL
+# История миграций SQLite начинается со старой схемы, поэтому для PostgreSQL первая версия сразу создаёт
+# схему, равную версии 6; следующие изменения добавляются в оба списка под одним номером
+POSTGRES_MIGRATIONS = [
+    (6, [
+        '''
+        CREATE TABLE specialists (
+            id SERIAL PRIMARY KEY,
+            surname TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TABLE projects (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TABLE assignments (
+            specialist_id INTEGER NOT NULL,
+            project_id INTEGER NOT NULL,
+            PRIMARY KEY (specialist_id, project_id)
+        )
+        ''',
+        '''
+        CREATE TABLE chats (
+            chat_id BIGINT PRIMARY KEY,
+            specialist_id INTEGER NOT NULL,
+            updated_at TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE tasks (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            project_id INTEGER NOT NULL,
+            task TEXT NOT NULL,
+            "interval" INTEGER NOT NULL,
+            next_reminder TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE users (
+            id BIGINT PRIMARY KEY,
+            surname TEXT,
+            status TEXT,
+            last_update TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE sent_reminders (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            task TEXT NOT NULL,
+            sent_at TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE sheets_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            specialist TEXT NOT NULL,
+            status TEXT NOT NULL,
+            date_on TEXT,
+            date_off TEXT,
+            created_at TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX idx_tasks_next_reminder ON tasks(next_reminder)",
+        "CREATE INDEX idx_tasks_chat_next_reminder ON tasks(chat_id, next_reminder)",
+        "CREATE UNIQUE INDEX ux_tasks_chat_project_task ON tasks(chat_id, project_id, task)",
+        "CREATE INDEX idx_assignments_project ON assignments(project_id)",
+        "CREATE INDEX idx_chats_specialist ON chats(specialist_id)",
+        "CREATE INDEX idx_users_status ON users(status)",
+        "CREATE INDEX idx_sent_reminders_chat_sent_at ON sent_reminders(chat_id, sent_at)",
+        "CREATE INDEX idx_sheets_outbox_next_attempt ON sheets_outbox(next_attempt)",
+    ]),
+    (7, CHAT_WINDOW_MIGRATION),
+    (8, CHAT_ACTIVE_MIGRATION),
+    (9, CHAT_DIGEST_MIGRATION),
+    (10, SHEETS_OUTBOX_FAILED_MIGRATION),
+]
+
+
+# ТЕКУЩАЯ ВЕРСИЯ СХЕМЫ
+def get_schema_version(conn):
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            applied_at TEXT
+        )
+    ''')
+    c.execute("SELECT MAX(version) FROM schema_migrations")
+    return c.fetchone()[0] or 0
+
+
+# ПРИМЕНЕНИЕ МИГРАЦИЙ
+def migrate(conn, migrations=MIGRATIONS, begin_statement="BEGIN"):
+    version = get_schema_version(conn)
+    conn.commit()
+    for target, statements in migrations:
+        if target <= version:
+            continue
+        c = conn.cursor()
+        if begin_statement:
+            c.execute(begin_statement)
+        try:
+            for statement in statements:
+                if callable(statement):
+                    statement(c)
+                else:
+                    c.execute(statement)
+            c.execute(
+                "INSERT INTO schema_migrations (version, applied_at) VALUES (?, ?)",
+                (target, datetime.now().isoformat())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception(f"Ошибка при применении миграции {target}")
+            raise
+        logger.info(f"Применена миграция схемы {target}")
+        version = target
+    return version
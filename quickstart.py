@@ -1,7 +1,10 @@
 import os
 import json
 import logging
+import threading
+import httplib2
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
@@ -22,6 +25,15 @@ SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
 RANGE_NAME = 'OPTIMA!A2:D'
 SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
 
+# Клиент Sheets и учетные данные создаются один раз на процесс; HTTP-соединение у каждого потока своё,
+# потому что httplib2.Http нельзя использовать из нескольких потоков одновременно
+_lock = threading.RLock()
+_local = threading.local()
+_credentials = None
+_service = None
+_transport = None
+_generation = 0
+
 def get_credentials():
     creds = None
     if SERVICE_ACCOUNT_FILE:
@@ -49,12 +61,42 @@ def get_credentials():
                 raise ValueError("Invalid credentials. Please update GOOGLE_TOKEN in .env file or use SERVICE_ACCOUNT_FILE.")
     return creds
 
+def get_cached_credentials():
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            _credentials = get_credentials()
+        return _credentials
+
+# Подмена HTTP-транспорта, например HttpMockSequence для локальной проверки без Google API
+def set_transport(factory):
+    global _service, _transport, _generation
+    with _lock:
+        _transport = factory
+        _service = None
+        _generation += 1
+
+def get_http():
+    if getattr(_local, 'generation', None) != _generation:
+        if _transport is not None:
+            _local.http = _transport()
+        else:
+            # AuthorizedHttp обновляет токен только когда срок его действия истёк
+            _local.http = AuthorizedHttp(get_cached_credentials(), http=httplib2.Http())
+        _local.generation = _generation
+    return _local.http
+
+def get_service():
+    global _service
+    with _lock:
+        if _service is None:
+            _service = build('sheets', 'v4', http=get_http(), cache_discovery=False)
+            logger.info("Сервис Google Sheets создан")
+        return _service
+
 def write_to_sheet(specialist, status, date_on=None, date_off=None):
     try:
-        creds = get_credentials()
-        logger.info("Credentials получены успешно")
-        service = build('sheets', 'v4', credentials=creds)
-        logger.info("Сервис Google Sheets создан")
+        service = get_service()
 
         values = [[
             specialist,
@@ -70,7 +112,7 @@ def write_to_sheet(specialist, status, date_on=None, date_off=None):
             spreadsheetId=SPREADSHEET_ID,
             range=RANGE_NAME,
             valueInputOption='USER_ENTERED',
-            body=body).execute()
+            body=body).execute(http=get_http())
 
         logger.info(f"Запрос к API выполнен. Результат: {result}")
         return result
@@ -78,41 +120,29 @@ def write_to_sheet(specialist, status, date_on=None, date_off=None):
         logger.error(f"Произошла ошибка при записи в таблицу: {error}")
         return error
 
+def format_row(specialist, status, date_on=None, date_off=None):
+    return [
+        specialist,
+        status,
+        date_on.strftime("%d.%m.%Y %H:%M:%S") if date_on else "",
+        date_off.strftime("%d.%m.%Y %H:%M:%S") if date_off else ""
+    ]
+
+# Добавление нескольких строк одним запросом values.append
+def append_rows(rows):
+    result = get_service().spreadsheets().values().append(
+        spreadsheetId=SPREADSHEET_ID,
+        range=RANGE_NAME,
+        valueInputOption='USER_ENTERED',
+        insertDataOption='INSERT_ROWS',
+        body={'values': rows}
+    ).execute(http=get_http())
+    logger.info(f"Добавлено строк в Google Sheets: {len(rows)}")
+    return result
+
 def update_sheet_row(specialist, status, date_on=None, date_off=None):
     try:
-        creds = get_credentials()
-        service = build('sheets', 'v4', credentials=creds)
-
-        # Получаем все значения из таблицы
-        result = service.spreadsheets().values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=RANGE_NAME
-        ).execute()
-        rows = result.get('values', [])
-
-        # Находим первую пустую строку
-        new_row_index = len(rows) + 1
-
-        # Подготавливаем новые данные
-        new_row = [
-            specialist,
-            status,
-            date_on.strftime("%d.%m.%Y %H:%M:%S") if date_on else "",
-            date_off.strftime("%d.%m.%Y %H:%M:%S") if date_off else ""
-        ]
-
-        # Добавляем новую строку
-        body = {
-            'values': [new_row]
-        }
-        result = service.spreadsheets().values().append(
-            spreadsheetId=SPREADSHEET_ID,
-            range=RANGE_NAME,
-            valueInputOption='USER_ENTERED',
-            insertDataOption='INSERT_ROWS',
-            body=body
-        ).execute()
-
+        result = append_rows([format_row(specialist, status, date_on, date_off)])
         logger.info(f"Новая строка добавлена в Google Sheets: {result}")
         return result
     except HttpError as error:
@@ -1,15 +1,27 @@
+import asyncio
+import functools
 import logging
-import json
 import telegram
 from telegram import Update
-import sqlite3
 from datetime import datetime, timedelta, time
 from dotenv import load_dotenv
 import warnings
-from quickstart import update_sheet_row
+from typing import NamedTuple
+from sheets_outbox import SheetsOutbox
+from delivery import Delivery
+from db import create_database
+from quickstart import format_row
+from catalog import CatalogStore, Specialist
+from templates import Templates, build_digest
+from business_calendar import BusinessCalendar
+from scheduler import ReminderQueue
+from update_processor import PerUserUpdateProcessor
+from webhook_server import run_webhook
+from metrics import Gauge, Histogram, start_metrics_server
 import pytz
 import os
-from telegram.ext import Application, CommandHandler, ConversationHandler, CallbackQueryHandler, PicklePersistence, PersistenceInput, ContextTypes
+from telegram.ext import (Application, CommandHandler, ConversationHandler, CallbackQueryHandler, ContextTypes,
+                          InlineQueryHandler, MessageHandler, filters)
 
 warnings.filterwarnings("ignore", category=telegram.warnings.PTBUserWarning)
 
@@ -23,140 +35,141 @@ CHOOSING_SPECIALIST = range(1)
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 SPECIALISTS_FILE = os.getenv('SPECIALISTS_FILE', 'specialists.json')
 TASKS_FILE = os.getenv('TASKS_FILE', 'tasks.json')
+HOLIDAYS_FILE = os.getenv('HOLIDAYS_FILE', 'holidays.json')
+CATALOG_CHECK_INTERVAL = 30
+SEARCH_RESULTS_LIMIT = 20
 START_TIME = time(10, 0)
 END_TIME = time(19, 0)
 TIMEZONE = pytz.timezone('Europe/Moscow')
+CHECK_JOB_NAME = 'check_reminders'
+RETRY_DELAY = timedelta(minutes=5)
+# Сколько обновлений обрабатывается одновременно (обновления одного пользователя — всегда по очереди)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 16))
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+# Локальный порт метрик в формате Prometheus; 0 отключает сервер метрик
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
 
-MONTHS = {
-    1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля', 5: 'мая', 6: 'июня',
-    7: 'июля', 8: 'августа', 9: 'сентября', 10: 'октября', 11: 'ноября', 12: 'декабря'
-}
+db = create_database()
+catalog = CatalogStore(SPECIALISTS_FILE, TASKS_FILE)
+sheets_outbox = SheetsOutbox(db)
+delivery = Delivery()
+templates = Templates(catalog)
+business_calendar = BusinessCalendar(HOLIDAYS_FILE)
+reminder_queue = ReminderQueue()
 
 
-# ЗАГРУЗКА JSON ФАЙЛА
-def load_json_file(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        logger.error(f"Файл {file_path} не найден.")
-        return None
-    except json.JSONDecodeError:
-        logger.error(f"Ошибка при разборе JSON в файле {file_path}.")
-        return None
+# СОСТОЯНИЕ ПРОВЕРКИ НАПОМИНАНИЙ
+# Задание run_once снимается с JobQueue в момент запуска, поэтому идущую проверку отмечаем сами:
+# иначе регистрация или смена окна во время долгой рассылки запустили бы вторую проверку
+# с теми же ещё не перенесёнными задачами. Чаты, отключённые во время проверки, запоминаются,
+# чтобы проверка не вернула их строки в очередь
+class CheckState:
+    def __init__(self):
+        self.running = False
+        self.deactivated = set()
+
+
+check_state = CheckState()
+
+
+# ВЕРСИЯ СПРАВОЧНИКОВ, С КОТОРОЙ СИНХРОНИЗИРОВАНО РАСПИСАНИЕ
+# Снимок справочников меняется раньше синхронизации; пока версии не совпадают, синхронизация повторяется
+class CatalogSyncState:
+    def __init__(self):
+        self.version = None
+
+
+catalog_sync = CatalogSyncState()
+
 
+# ОКНО ОТПРАВКИ НАПОМИНАНИЙ ЧАТА
+class ReminderWindow(NamedTuple):
+    timezone: pytz.BaseTzInfo
+    start: time
+    end: time
 
-# ЗАГРУЗКА СПЕЦИАЛИСТОВ
-def load_specialists():
-    specialists_data = load_json_file(SPECIALISTS_FILE)
-    return sorted(specialists_data['specialists'], key=lambda x: x['surname']) if specialists_data else []
 
+DEFAULT_WINDOW = ReminderWindow(TIMEZONE, START_TIME, END_TIME)
 
-# ЗАГРУЗКА ЗАДАЧ
-def load_tasks():
-    tasks_data = load_json_file(TASKS_FILE)
-    return tasks_data['tasks'] if tasks_data else []
+TICK_SECONDS = Histogram('reminder_tick_seconds', 'Длительность проверки напоминаний')
+DUE_TASKS = Histogram('reminder_due_tasks', 'Задачи, найденные за одну проверку напоминаний',
+                      buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000))
+# Деактивированные чаты удаляются из очереди, поэтому в ней только активные чаты с напоминаниями
+Gauge('reminder_active_chats', 'Активные чаты с запланированными напоминаниями').set_function(
+    lambda: len(reminder_queue.chats))
+Gauge('reminder_scheduled', 'Запланированные напоминания в очереди').set_function(lambda: len(reminder_queue))
+
+
+# Настройки чата из базы: название часового пояса и границы окна в виде «ЧЧ:ММ»
+@functools.lru_cache(maxsize=None)
+def get_window(timezone_name, window_start, window_end) -> ReminderWindow:
+    return ReminderWindow(pytz.timezone(timezone_name), time.fromisoformat(window_start), time.fromisoformat(window_end))
 
 
 # ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ
 def init_db():
-    with sqlite3.connect('tasks.db') as conn:
-        c = conn.cursor()
-        c.execute("DROP TABLE IF EXISTS tasks")
-        c.execute("DROP TABLE IF EXISTS sent_reminders")
-        c.execute("DROP TABLE IF EXISTS users")
-        c.execute('''
-            CREATE TABLE tasks (
-                id INTEGER PRIMARY KEY,
-                project TEXT,
-                task TEXT,
-                interval INTEGER,
-                next_reminder TEXT
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE sent_reminders (
-                task_id INTEGER PRIMARY KEY,
-                sent_at TEXT,
-                responded BOOLEAN
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE users (
-                id INTEGER PRIMARY KEY,
-                surname TEXT,
-                status TEXT,
-                last_update TEXT
-            )
-        ''')
-        c.execute("CREATE INDEX idx_tasks_next_reminder ON tasks(next_reminder)")
-        c.execute("CREATE INDEX idx_sent_reminders_task_id ON sent_reminders(task_id)")
-        c.execute("CREATE INDEX idx_users_status ON users(status)")
-    logger.info("База данных инициализирована")
+    version = db.migrate()
+    logger.info(f"База данных инициализирована, версия схемы: {version}")
 
 
 # ИНИЦИАЛИЗАЦИЯ ЗАДАЧ ДЛЯ СПЕЦИАЛИСТА
-def init_tasks_for_specialist(specialist):
-    tasks = load_tasks()
-    now = datetime.now(TIMEZONE)
-
-    with sqlite3.connect('tasks.db') as conn:
-        c = conn.cursor()
-        for project in specialist['projects']:
-            for task in tasks:
-                # Убедитесь, что вы используете правильный ключ для доступа к интервалу
-                next_reminder = now + timedelta(days=task['interval_days'])
-                next_reminder = get_next_workday(next_reminder)
-                c.execute(
-                    "INSERT INTO tasks (project, task, interval, next_reminder) VALUES (?, ?, ?, ?)",
-                    (project, task['task'], task['interval_days'], next_reminder.isoformat())
-                )
-
-    logger.info(f"Задачи загружены для специалиста {specialist['surname']}")
+async def init_tasks_for_specialist(chat_id, specialist):
+    tasks = [(task.task, task.interval_days) for task in catalog.current.tasks]
+    added, removed = await db.seed_tasks(chat_id, specialist.projects, tasks, schedule_reminder,
+                                         datetime.now(TIMEZONE))
+    logger.info(f"Задачи загружены для специалиста {specialist.surname}: добавлено {added}, удалено {removed}")
 
 
 # ОБНОВЛЕНИЕ СТАТУСА ПОЛЬЗОВАТЕЛЯ
-def update_user_status(user_id, surname, status):
+async def update_user_status(user_id, surname, status):
     now = datetime.now(TIMEZONE)
-    with sqlite3.connect('tasks.db') as conn:
-        c = conn.cursor()
-        c.execute("SELECT status FROM users WHERE id = ?", (user_id,))
-        old_status = c.fetchone()
-        if old_status is None or old_status[0] != status:
-            c.execute(
-                "INSERT OR REPLACE INTO users (id, surname, status, last_update) VALUES (?, ?, ?, ?)",
-                (user_id, surname, status, now.isoformat())
-            )
-            date_on = now if status == "Подключен" else None
-            date_off = now if status == "Отключен" else None
-            try:
-                update_sheet_row(surname, status, date_on=date_on, date_off=date_off)
-                logger.info(f"Статус пользователя {surname} обновлен в Google Sheets: {status}")
-            except Exception as e:
-                logger.error(f"Ошибка при обновлении статуса в Google Sheets: {e}")
+    date_on = now if status == "Подключен" else None
+    date_off = now if status == "Отключен" else None
+    if await db.set_user_status(user_id, surname, status, now, format_row(surname, status, date_on, date_off)):
+        sheets_outbox.notify()
     logger.info(f"Статус пользователя {surname} обновлен: {status}")
 
 
-# ПОЛУЧЕНИЕ СТРОКИ ИНТЕРВАЛА
-def get_interval_string(interval: int) -> str:
-    if interval == 1:
-        return "**1 день**"
-    elif 2 <= interval <= 4:
-        return f"**{interval} дня**"
-    else:
-        return f"**{interval} дней**"
-
-
-# ПРОВЕРКА НА РАБОЧИЙ ДЕНЬ
+# ПРОВЕРКА НА РАБОЧИЙ ДЕНЬ (ВЫХОДНЫЕ, ПРАЗДНИКИ И ПЕРЕНОСЫ)
 def is_workday(date):
-    return date.weekday() < 5  # 0-4 это понедельник-пятница
+    return business_calendar.is_workday(date)
 
 
 # ПОЛУЧЕНИЕ СЛЕДУЮЩЕГО РАБОЧЕГО ДНЯ
 def get_next_workday(date):
-    while not is_workday(date):
-        date += timedelta(days=1)
-    return date
+    return business_calendar.next_workday(date)
+
+
+# ПРОВЕРКА ВРЕМЕНИ ОТПРАВКИ НАПОМИНАНИЙ
+def is_reminder_time(date, window=DEFAULT_WINDOW):
+    local = date.astimezone(window.timezone)
+    return window.start <= local.time() <= window.end and is_workday(local)
+
+
+# ПОЛУЧЕНИЕ БЛИЖАЙШЕГО ВРЕМЕНИ ОТПРАВКИ НАПОМИНАНИЙ
+def get_next_reminder_time(date, window=DEFAULT_WINDOW):
+    local = date.astimezone(window.timezone)
+    if is_reminder_time(local, window):
+        return local
+    day = local.date()
+    if not is_workday(day) or local.time() > window.end:
+        day = get_next_workday(day + timedelta(days=1))
+    return window.timezone.localize(datetime.combine(day, window.start))
+
+
+# ДАТА НАПОМИНАНИЯ ЧЕРЕЗ days ДНЕЙ ПОСЛЕ start В ОКНЕ ЧАТА
+# Время суток сохраняется, выходные и праздники пропускаются, время вне окна сдвигается к его началу
+def schedule_reminder(start, days, settings) -> datetime:
+    window = get_window(*settings)
+    local = start.astimezone(window.timezone)
+    day = get_next_workday(local.date() + timedelta(days=days))
+    return get_next_reminder_time(window.timezone.localize(datetime.combine(day, local.time())), window)
+
+
+# ПЕРЕНОС ДАТЫ НАПОМИНАНИЯ В ОКНО ЧАТА
+def clamp_reminder(date, settings) -> datetime:
+    return get_next_reminder_time(date, get_window(*settings))
 
 
 # КОМАНДА СТАРТ
@@ -167,151 +180,353 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         "\n🗓️ Если нужно что-то изменить или добавить, в конце месяца соберу ОС! 🌟"
     )
     await update.message.reply_text(welcome_message)
-    specialists = load_specialists()
-    keyboard = [[telegram.InlineKeyboardButton(spec['surname'], callback_data=f"specialist:{spec['surname']}")] for spec
-                in specialists]
-    reply_markup = telegram.InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text('Теперь выбери свою фамилию', reply_markup=reply_markup)
+    await update.message.reply_text('Теперь выбери свою фамилию', reply_markup=templates.specialists_keyboard())
     return CHOOSING_SPECIALIST
 
 
 # ОТПРАВКА СПИСКА НАПОМИНАНИЙ
 async def send_reminder_list(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = context.job.data['chat_id']
-    projects = context.job.data['projects']
-    with sqlite3.connect('tasks.db') as conn:
-        c = conn.cursor()
-        placeholders = ','.join('?' for _ in projects)
-        c.execute(f"""
-            SELECT t.task, t.interval
-            FROM tasks t
-            WHERE t.project IN ({placeholders})
-        """, projects)
-        tasks = c.fetchall()
-    if tasks:
-        message_lines = []
-        message_lines.append("*СПИСОК ТВОИХ НАПОМИНАНИЙ и ГРАФИК ПРОВЕРКИ*\n\n")
-        unique_tasks = {task[0].lower(): (task[0], task[1]) for task in tasks}
-        for task_name, (original_name, interval) in unique_tasks.items():
-            task_name_upper = original_name.capitalize()
-            interval_string = get_interval_string(interval)
-            message_lines.append(f"• {task_name_upper} - {interval_string}\n")
-        message = "".join(message_lines)
-        await context.bot.send_message(chat_id=chat_id, text=message, parse_mode='Markdown')
+    # Задачи чатов совпадают со справочником, поэтому список берётся из кэша без запроса к базе
+    if catalog.current.tasks:
+        chat_id = context.job.data['chat_id']
+        error = await delivery.send(context.bot, chat_id, templates.reminder_list(), parse_mode='Markdown')
+        if isinstance(error, telegram.error.Forbidden):
+            await deactivate_chats(context.job_queue, [chat_id])
 
 
 # ОТПРАВКА БЛИЖАЙШЕЙ ЗАДАЧИ
 async def send_nearest_task(context: ContextTypes.DEFAULT_TYPE):
     chat_id = context.job.data['chat_id']
     projects = context.job.data['projects']
-    now = datetime.now(TIMEZONE)
-    with sqlite3.connect('tasks.db') as conn:
-        c = conn.cursor()
-        placeholders = ','.join('?' for _ in projects)
-        c.execute(f"""
-            SELECT t.task, t.next_reminder, t.interval
-            FROM tasks t
-            WHERE t.project IN ({placeholders})
-            ORDER BY t.next_reminder ASC
-            LIMIT 1
-        """, projects)
-        nearest_task = c.fetchone()
+    nearest_task = await db.nearest_task(chat_id)
     if nearest_task:
-        task, next_reminder, interval = nearest_task
-        next_reminder = datetime.fromisoformat(next_reminder)
-        next_reminder_str = f"{next_reminder.day} {MONTHS[next_reminder.month]}"
-        projects_list = "\n".join(f"- {project}" for project in sorted(projects))
-        message = (
-            f"*📋ПОРА {task.upper()}*\n\n"
-            f"{projects_list}\n\n"
-            f"*⏰СЛЕДУЮЩИЙ РАЗ НАПОМНЮ {next_reminder_str}*"
-        )
-        await context.bot.send_message(chat_id=chat_id, text=message, parse_mode='Markdown')
+        task, next_reminder, interval, timezone_name = nearest_task
+        next_reminder = next_reminder.astimezone(pytz.timezone(timezone_name))
+        error = await delivery.send(context.bot, chat_id, templates.reminder(task, projects, next_reminder),
+                                    parse_mode='Markdown')
     else:
-        await context.bot.send_message(chat_id=chat_id, text="У вас нет запланированных задач.")
+        error = await delivery.send(context.bot, chat_id, "У вас нет запланированных задач.")
+    if isinstance(error, telegram.error.Forbidden):
+        await deactivate_chats(context.job_queue, [chat_id])
+
+
+# ПОДКЛЮЧЕНИЕ ВЫБРАННОГО СПЕЦИАЛИСТА
+async def connect_specialist(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int,
+                             specialist: Specialist) -> None:
+    context.user_data['surname'] = specialist.surname
+    context.user_data['projects'] = list(specialist.projects)
+    # Регистрация чата в общем планировщике напоминаний
+    await register_chat(context, chat_id, specialist)
+    await init_tasks_for_specialist(chat_id, specialist)
+    await reload_chat_schedule(context.job_queue, chat_id)
+    # Повторный выбор фамилии заменяет ещё не выполненные задания чата, а не добавляет новые
+    cancel_chat_jobs(context.job_queue, chat_id)
+    # Отправка списка напоминаний через 10 секунд
+    context.job_queue.run_once(send_reminder_list, 10, name=str(chat_id),
+                               data={'projects': list(specialist.projects), 'chat_id': chat_id})
+    # Отправка ближайшей задачи через 20 секунд
+    context.job_queue.run_once(send_nearest_task, 20, name=str(chat_id),
+                               data={'projects': list(specialist.projects), 'chat_id': chat_id})
+    await update_user_status(user_id, specialist.surname, "Подключен")
 
 
 # ВЫБОР СПЕЦИАЛИСТА
 async def specialist_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    _, surname = query.data.split(':')
-    specialists = load_specialists()
-    specialist = next((s for s in specialists if s['surname'] == surname), None)
+    _, surname = query.data.split(':', 1)
+    specialist = catalog.current.by_surname.get(surname)
     if specialist:
-        context.user_data['surname'] = specialist['surname']
-        context.user_data['projects'] = specialist['projects']
-        project_list = "\n".join([f"{i + 1}. {project}" for i, project in enumerate(specialist['projects'])])
-        await query.edit_message_text(f"*ТВОИ ПРОЕКТЫ:*\n{project_list}", parse_mode='Markdown')
-        init_tasks_for_specialist(specialist)
-        # Отправка списка напоминаний через 10 секунд
-        context.job_queue.run_once(send_reminder_list, 10,
-                                   data={'projects': specialist['projects'], 'chat_id': query.message.chat.id})
-        # Отправка ближайшей задачи через 20 секунд
-        context.job_queue.run_once(send_nearest_task, 20,
-                                   data={'projects': specialist['projects'], 'chat_id': query.message.chat.id})
-        # Запуск регулярных проверок каждые 48 секунд
-        context.job_queue.run_repeating(check_reminders, interval=300, first=5,
-                                        data={'projects': specialist['projects'], 'chat_id': query.message.chat.id},
-                                        name=str(query.message.chat.id))
-        update_user_status(query.from_user.id, specialist['surname'], "Подключен")
+        await query.edit_message_text(templates.project_list(specialist), parse_mode='Markdown')
+        await connect_specialist(context, query.message.chat.id, query.from_user.id, specialist)
     return ConversationHandler.END
 
 
-# ОТПРАВКА НАПОМИНАНИЯ
-async def send_reminder(context: ContextTypes.DEFAULT_TYPE, chat_id: int, task: str, projects: list,
-                        interval: int) -> None:
-    projects_list = "\n".join(f"- {project}" for project in sorted(projects))
-    next_reminder = datetime.now(TIMEZONE) + timedelta(days=interval)
-    next_reminder = get_next_workday(next_reminder)
-    next_reminder_str = f"{next_reminder.day} {MONTHS[next_reminder.month]}"
-    message = f"*📋ПОРА {task.upper()}*\n\n{projects_list}\n\n*⏰СЛЕДУЮЩИЙ РАЗ НАПОМНЮ {next_reminder_str}*"
+# ЛИСТАНИЕ СПИСКА СПЕЦИАЛИСТОВ
+async def specialist_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    if query.data == 'letters':
+        reply_markup = templates.specialists_keyboard()
+    else:
+        _, letter, page = query.data.split(':')
+        reply_markup = templates.specialists_keyboard(letter, int(page))
+    await query.edit_message_reply_markup(reply_markup)
+    return CHOOSING_SPECIALIST
+
+
+# ПОИСК СПЕЦИАЛИСТА ПО НАЧАЛУ ФАМИЛИИ (INLINE-РЕЖИМ)
+async def search_specialists(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.inline_query
+    offset = int(query.offset or 0)
+    found = catalog.current.search(query.query, offset, SEARCH_RESULTS_LIMIT)
+    results = [
+        telegram.InlineQueryResultArticle(
+            id=str(offset + i),
+            title=specialist.surname,
+            description=", ".join(specialist.projects),
+            input_message_content=telegram.InputTextMessageContent(specialist.surname),
+        )
+        for i, specialist in enumerate(found)
+    ]
+    next_offset = str(offset + len(found)) if len(found) == SEARCH_RESULTS_LIMIT else ""
+    await query.answer(results, cache_time=CATALOG_CHECK_INTERVAL, next_offset=next_offset)
+
+
+# ВЫБОР СПЕЦИАЛИСТА ИЗ РЕЗУЛЬТАТОВ ПОИСКА
+async def specialist_search_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    specialist = catalog.current.by_surname.get(update.message.text.strip())
+    if specialist is None:
+        await update.message.reply_text("Такой фамилии нет в списке, выбери её кнопкой или через поиск")
+        return CHOOSING_SPECIALIST
+    await update.message.reply_text(templates.project_list(specialist), parse_mode='Markdown')
+    await connect_specialist(context, update.message.chat.id, update.message.from_user.id, specialist)
+    return ConversationHandler.END
+
+
+# ТЕКСТ НАПОМИНАНИЯ
+def format_reminder(task: str, projects: list, next_reminder: datetime) -> str:
+    return templates.reminder(task, projects, next_reminder)
+
+
+# ОТПРАВКА НАПОМИНАНИЙ
+# Чатам в режиме сводки все напоминания уходят одним сообщением (или несколькими, если не помещаются
+# в лимит Telegram). Возвращает ошибку отправки для каждого напоминания
+async def send_reminders(context: ContextTypes.DEFAULT_TYPE, reminders: list, digest_chats=frozenset()) -> list:
+    messages = []
+    covered = []
+    digests = {}
+    for index, (chat_id, task, projects, next_reminder) in enumerate(reminders):
+        text = format_reminder(task, projects, next_reminder)
+        if chat_id in digest_chats:
+            digests.setdefault(chat_id, []).append((index, text))
+        else:
+            messages.append((chat_id, text, {'parse_mode': 'Markdown'}))
+            covered.append([index])
+    for chat_id, parts in digests.items():
+        for text, positions in build_digest([text for _, text in parts]):
+            messages.append((chat_id, text, {'parse_mode': 'Markdown'}))
+            covered.append([parts[position][0] for position in positions])
+
+    message_results = await delivery.send_many(context.bot, messages)
+    results = [None] * len(reminders)
+    blocked = set()
+    for (chat_id, *_), indexes, error in zip(messages, covered, message_results):
+        if isinstance(error, telegram.error.Forbidden):
+            if chat_id not in blocked:
+                logger.warning(f"Пользователь {chat_id} заблокировал бота")
+                blocked.add(chat_id)
+        elif error is not None:
+            logger.error(f"Ошибка при отправке напоминания в чат {chat_id}: {error}")
+        for index in indexes:
+            results[index] = error
+    return results
+
+
+# РЕГИСТРАЦИЯ ЧАТА В ПЛАНИРОВЩИКЕ
+async def register_chat(context: ContextTypes.DEFAULT_TYPE, chat_id: int, specialist: Specialist) -> None:
+    await db.save_chat(chat_id, specialist.surname, specialist.projects, schedule_reminder,
+                      datetime.now(TIMEZONE))
+
+
+# ОТМЕНА ЗАДАНИЙ ЧАТА
+# Все разовые задания чата называются str(chat_id), поэтому их число не растёт с повторными регистрациями
+def cancel_chat_jobs(job_queue, chat_id: int) -> None:
+    for job in job_queue.get_jobs_by_name(str(chat_id)):
+        job.schedule_removal()
+
+
+# ОТКЛЮЧЕНИЕ ЧАТОВ
+# Отключённый чат исключается из выборки напоминаний, его задачи в очереди заданий отменяются
+async def deactivate_chats(job_queue, chat_ids) -> None:
+    await db.deactivate_chats(chat_ids, datetime.now(TIMEZONE))
+    for chat_id in chat_ids:
+        reminder_queue.remove_chat(chat_id)
+        cancel_chat_jobs(job_queue, chat_id)
+    if check_state.running:
+        check_state.deactivated.update(chat_ids)
+    logger.info(f"Чаты отключены: {', '.join(map(str, chat_ids))}")
+
+
+# ЗАГРУЗКА РАСПИСАНИЯ В ОЧЕРЕДЬ НАПОМИНАНИЙ
+async def load_schedule(job_queue) -> None:
+    reminder_queue.load(await db.reminder_schedule())
+    logger.info(f"Расписание загружено: напоминаний {len(reminder_queue)}, чатов {len(reminder_queue.chats)}")
+    schedule_nearest(job_queue)
+
+
+# ОБНОВЛЕНИЕ РАСПИСАНИЯ ОДНОГО ЧАТА
+async def reload_chat_schedule(job_queue, chat_id: int) -> None:
+    rows = await db.reminder_schedule(chat_id)
+    # Чат снова активен: идущая проверка может обновить его строки в очереди
+    check_state.deactivated.discard(chat_id)
+    reminder_queue.load_chat(chat_id, [(task_id, next_reminder) for task_id, _, next_reminder in rows])
+    schedule_nearest(job_queue)
+
+
+# СИНХРОНИЗАЦИЯ РАСПИСАНИЯ СО СПРАВОЧНИКАМИ
+async def sync_catalog(job_queue) -> None:
+    current = catalog.current
+    if not current.specialists or not current.tasks:
+        # Пустой справочник означает ошибку загрузки, а не команду удалить всё расписание
+        logger.warning("Справочники пусты, синхронизация расписания пропущена")
+        catalog_sync.version = current.version
+        return
+    added, removed, changed = await db.sync_catalog(current.specialists, current.tasks, schedule_reminder,
+                                                    datetime.now(TIMEZONE))
+    catalog_sync.version = current.version
+    logger.info(f"Расписание синхронизировано со справочниками версии {current.version}: "
+                f"добавлено {added}, удалено {removed}, изменён интервал {changed}")
+    if added or removed or changed:
+        await load_schedule(job_queue)
+
+
+# ПРОВЕРКА ИЗМЕНЕНИЙ СПРАВОЧНИКОВ
+async def watch_catalog(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await asyncio.to_thread(catalog.reload_if_changed)
+    if catalog_sync.version == catalog.current.version:
+        return
     try:
-        await context.bot.send_message(chat_id=chat_id, text=message, parse_mode='Markdown')
-    except telegram.error.Forbidden:
-        logger.warning(f"Пользователь {chat_id} заблокировал бота")
+        await sync_catalog(context.job_queue)
+    except Exception as e:
+        logger.error(f"Ошибка синхронизации расписания со справочниками: {e}, "
+                     f"повтор через {CATALOG_CHECK_INTERVAL} с")
+
+
+# ЗАПУСК ФОНОВЫХ ЗАДАЧ
+async def post_init(application: Application) -> None:
+    await asyncio.to_thread(catalog.reload_if_changed)
+    await sync_catalog(application.job_queue)
+    application.job_queue.run_repeating(watch_catalog, interval=CATALOG_CHECK_INTERVAL,
+                                        first=CATALOG_CHECK_INTERVAL, name='watch_catalog')
+    await load_schedule(application.job_queue)
+    sheets_outbox.start()
+    if METRICS_PORT:
+        application.bot_data['metrics_server'] = start_metrics_server(METRICS_PORT, METRICS_LISTEN)
+
+
+# ОСТАНОВКА ФОНОВЫХ ЗАДАЧ
+async def post_shutdown(application: Application) -> None:
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server is not None:
+        metrics_server.stop()
+    await sheets_outbox.stop()
+    db.close()
+
+
+# ПЛАНИРОВАНИЕ СЛЕДУЮЩЕЙ ПРОВЕРКИ НАПОМИНАНИЙ
+# Время запуска хранится в data задания: до старта JobQueue (в post_init) у заданий ещё нет next_t
+def schedule_check(job_queue, when: datetime) -> None:
+    if check_state.running:
+        # Идущая проверка сама запланирует следующую по очереди напоминаний, когда закончит
+        return
+    for job in job_queue.get_jobs_by_name(CHECK_JOB_NAME):
+        if job.data is not None and job.data <= when:
+            return
+        job.schedule_removal()
+    job_queue.run_once(check_reminders, when, data=when, name=CHECK_JOB_NAME)
+    logger.info(f"Следующая проверка напоминаний запланирована на {when}")
+
+
+# ПЛАНИРОВАНИЕ ПРОВЕРКИ К БЛИЖАЙШЕМУ НАПОМИНАНИЮ ИЗ ОЧЕРЕДИ
+def schedule_nearest(job_queue) -> None:
+    nearest = reminder_queue.nearest()
+    if nearest is not None:
+        schedule_check(job_queue, max(nearest, datetime.now(TIMEZONE) + timedelta(seconds=1)))
 
 
 # ПРОВЕРКА НАПОМИНАНИЙ
+# Даты напоминаний хранятся уже сдвинутыми в окно отправки своего чата, поэтому проверка просыпается
+# к открытию ближайшего окна и получает только задачи чатов, которым сейчас можно писать
 async def check_reminders(context: ContextTypes.DEFAULT_TYPE) -> None:
-    now = datetime.now(TIMEZONE)
-    if START_TIME <= now.time() <= END_TIME and is_workday(now):
-        logger.info(f"Проверка напоминаний в {now}")
-        with sqlite3.connect('tasks.db') as conn:
-            c = conn.cursor()
-            projects = context.job.data['projects']
-            placeholders = ','.join('?' for _ in projects)
-            c.execute(
-                f"""
-                SELECT t.id, t.project, t.task, t.interval
-                FROM tasks t
-                WHERE t.next_reminder <= ? AND t.project IN ({placeholders})
-                """,
-                (now.isoformat(), *projects)
-            )
-            tasks = c.fetchall()
-        logger.info(f"Найдено задач для напоминания: {len(tasks)}")
-        reminders = {}
-        for task_id, project, task_name, interval in tasks:
-            if task_name not in reminders:
-                reminders[task_name] = {"projects": set(), "ids": [], "interval": interval}
-            reminders[task_name]["projects"].add(project)
-            reminders[task_name]["ids"].append(task_id)
-        for task_name, reminder_data in reminders.items():
-            await send_reminder(context, context.job.data['chat_id'], task_name, list(reminder_data["projects"]),
-                                reminder_data["interval"])
-            next_reminder_time = now + timedelta(days=reminder_data["interval"])
-            next_reminder_time = get_next_workday(next_reminder_time)
-            with sqlite3.connect('tasks.db') as conn:
-                c = conn.cursor()
-                for task_id in reminder_data["ids"]:
-                    c.execute("UPDATE tasks SET next_reminder = ? WHERE id = ?",
-                              (next_reminder_time.isoformat(), task_id))
-                conn.commit()
+    check_state.running = True
+    check_state.deactivated.clear()
+    failed = False
+    try:
+        with TICK_SECONDS.time():
+            await run_reminder_check(context)
+    except Exception as e:
+        # Следующая проверка планируется и после сбоя, иначе ошибка базы остановила бы все напоминания
+        logger.error(f"Ошибка при проверке напоминаний: {e}, повтор через {RETRY_DELAY}")
+        failed = True
+    finally:
+        check_state.running = False
+    if failed:
+        schedule_check(context.job_queue, datetime.now(TIMEZONE) + RETRY_DELAY)
     else:
-        logger.info(
-            f"Текущее время {now.time()} не соответствует времени отправки напоминаний ({START_TIME}-{END_TIME}) или сегодня выходной"
-        )
+        # Засыпаем до ближайшего напоминания из очереди, не обращаясь к базе; очередь уже учитывает
+        # чаты, расписание которых обновилось во время проверки
+        schedule_nearest(context.job_queue)
+
+
+async def run_reminder_check(context: ContextTypes.DEFAULT_TYPE) -> None:
+    now = datetime.now(TIMEZONE)
+    logger.info(f"Проверка напоминаний в {now}")
+    tasks = await db.due_tasks(now)
+    DUE_TASKS.observe(len(tasks))
+    logger.info(f"Найдено задач для напоминания: {len(tasks)}")
+
+    reminders = {}
+    advanced = []
+    digest_chats = set()
+    for task_id, chat_id, project, task_name, interval, digest, *settings in tasks:
+        window = get_window(*settings)
+        if not is_reminder_time(now, window):
+            # Проверка запустилась позже закрытия окна чата — переносим напоминание в следующее окно
+            advanced.append((get_next_reminder_time(now, window), task_id, chat_id))
+            continue
+        if digest:
+            digest_chats.add(chat_id)
+        key = (chat_id, task_name)
+        if key not in reminders:
+            reminders[key] = {"projects": set(), "ids": [], "next_reminder": schedule_reminder(now, interval, settings),
+                              "window": window}
+        reminders[key]["projects"].add(project)
+        reminders[key]["ids"].append(task_id)
+
+    results = await send_reminders(context, [
+        (chat_id, task_name, list(reminder_data["projects"]), reminder_data["next_reminder"])
+        for (chat_id, task_name), reminder_data in reminders.items()
+    ], digest_chats)
+
+    # Запись в журнал и перенос напоминаний в одной транзакции: неотправленные повторяются
+    # через RETRY_DELAY, но не раньше следующего открытия окна чата
+    sent_at = datetime.now(TIMEZONE)
+    log_rows = []
+    blocked = set()
+    for ((chat_id, task_name), reminder_data), error in zip(reminders.items(), results):
+        if isinstance(error, telegram.error.Forbidden):
+            blocked.add(chat_id)
+        if error is None:
+            log_rows.append((chat_id, task_name, sent_at, 'sent', None))
+            next_reminder = reminder_data["next_reminder"]
+        else:
+            log_rows.append((chat_id, task_name, sent_at, 'failed', f"{type(error).__name__}: {error}"))
+            next_reminder = get_next_reminder_time(now + RETRY_DELAY, reminder_data["window"])
+        advanced.extend((next_reminder, task_id, chat_id) for task_id in reminder_data["ids"])
+    await db.record_deliveries(log_rows, [(next_reminder, task_id) for next_reminder, task_id, _ in advanced])
+    for next_reminder, task_id, chat_id in advanced:
+        if chat_id not in check_state.deactivated:
+            reminder_queue.update(task_id, chat_id, next_reminder)
+    # Заблокировавшим бота больше не пишем, пока они сами не вернутся через /start
+    if blocked:
+        await deactivate_chats(context.job_queue, sorted(blocked))
+
+    nearest = reminder_queue.nearest()
+    if nearest is not None and nearest <= now:
+        # Очередь разошлась с базой (просроченная строка не пришла из неё) — перечитываем расписание
+        logger.warning("Очередь напоминаний не совпадает с базой, расписание перечитывается")
+        await load_schedule(context.job_queue)
+
+
+# СОСТОЯНИЕ ДЛЯ HTTP-ПРОВЕРКИ РАБОТОСПОСОБНОСТИ
+def health_status() -> dict:
+    return {
+        'status': 'ok',
+        'catalog_version': catalog.current.version,
+        'scheduled_reminders': len(reminder_queue),
+        'scheduled_chats': len(reminder_queue.chats),
+    }
 
 
 # ОБРАБОТЧИК ОШИБОК
@@ -322,47 +537,115 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 # КОМАНДА СТОП
 async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_surname = context.user_data.get('surname', 'Неизвестный пользователь')
-    update_user_status(update.message.from_user.id, user_surname, "Отключен")
+    await deactivate_chats(context.job_queue, [update.message.chat.id])
+    await update_user_status(update.message.from_user.id, user_surname, "Отключен")
     await update.message.reply_text("Вы отключены от бота. Если захотите снова подключиться, просто напишите /start.")
 
 
+# СМЕНА НАСТРОЕК ЧАТА И ПЕРЕНОС ЕГО НАПОМИНАНИЙ
+async def change_chat_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, timezone_name=None,
+                               window_start=None, window_end=None) -> None:
+    chat_id = update.message.chat.id
+    settings = await db.update_chat_settings(chat_id, timezone_name, window_start, window_end, clamp_reminder)
+    if settings is None:
+        await update.message.reply_text("Сначала выбери свою фамилию командой /start.")
+        return
+    await reload_chat_schedule(context.job_queue, chat_id)
+    timezone_name, window_start, window_end = settings
+    logger.info(f"Настройки чата {chat_id} изменены: {timezone_name}, {window_start}-{window_end}")
+    await update.message.reply_text(
+        f"Напоминания приходят по рабочим дням с {window_start} до {window_end}, часовой пояс {timezone_name}."
+    )
+
+
+# КОМАНДА РЕЖИМА СВОДКИ
+async def set_digest(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    modes = {'on': True, 'вкл': True, 'off': False, 'выкл': False}
+    if len(context.args) != 1 or context.args[0].lower() not in modes:
+        await update.message.reply_text("Укажи режим: /digest on — одно сообщение со всеми напоминаниями, "
+                                        "/digest off — каждое напоминание отдельно")
+        return
+    enabled = modes[context.args[0].lower()]
+    if not await db.set_chat_digest(update.message.chat.id, enabled):
+        await update.message.reply_text("Сначала выбери свою фамилию командой /start.")
+        return
+    logger.info(f"Режим сводки для чата {update.message.chat.id}: {enabled}")
+    await update.message.reply_text("Напоминания будут приходить одним сообщением." if enabled
+                                    else "Каждое напоминание будет приходить отдельным сообщением.")
+
+
+# КОМАНДА ЧАСОВОГО ПОЯСА
+async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if len(context.args) != 1:
+        await update.message.reply_text("Укажи часовой пояс, например: /timezone Asia/Yekaterinburg")
+        return
+    try:
+        timezone_name = pytz.timezone(context.args[0]).zone
+    except pytz.UnknownTimeZoneError:
+        await update.message.reply_text(f"Не знаю часовой пояс {context.args[0]}. Пример: Europe/Moscow")
+        return
+    await change_chat_settings(update, context, timezone_name=timezone_name)
+
+
+# КОМАНДА ОКНА ОТПРАВКИ
+async def set_window(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        window_start, window_end = (time.fromisoformat(value) for value in context.args)
+    except ValueError:
+        window_start = window_end = None
+    if window_start is None or window_start >= window_end:
+        await update.message.reply_text("Укажи начало и конец окна, например: /window 09:00 18:00")
+        return
+    await change_chat_settings(update, context, window_start=window_start.strftime('%H:%M'),
+                               window_end=window_end.strftime('%H:%M'))
+
+
 def main() -> None:
     init_db()
     logger.info(f"Бот запущен. Текущее время: {datetime.now(TIMEZONE)}")
 
-    application = Application.builder().token(BOT_TOKEN).build()
-
-    # Добавляем обработчик для health check
-    async def health_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        await update.message.reply_text("OK")
-
-    application.add_handler(CommandHandler("health", health_check))
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
-            CHOOSING_SPECIALIST: [CallbackQueryHandler(specialist_choice)],
+            CHOOSING_SPECIALIST: [
+                CallbackQueryHandler(specialist_page, pattern=r'^(letters|page:)'),
+                CallbackQueryHandler(specialist_choice, pattern=r'^specialist:'),
+                MessageHandler(filters.VIA_BOT & filters.TEXT, specialist_search_choice),
+            ],
         },
         fallbacks=[],
     )
 
     application.add_handler(conv_handler)
+    application.add_handler(InlineQueryHandler(search_specialists))
     application.add_handler(CommandHandler("stop", stop))
+    application.add_handler(CommandHandler("timezone", set_timezone))
+    application.add_handler(CommandHandler("window", set_window))
+    application.add_handler(CommandHandler("digest", set_digest))
     application.add_error_handler(error_handler)
 
     if os.environ.get('RENDER'):
-        port = int(os.environ.get('PORT', 10000))
-        webhook_url = os.environ.get("WEBHOOK_URL")
-        application.run_webhook(
+        # Собственный сервер вместо application.run_webhook: на том же порту отвечает GET /health
+        asyncio.run(run_webhook(
+            application,
             listen="0.0.0.0",
-            port=port,
-            webhook_url=webhook_url,
+            port=int(os.environ.get('PORT', 10000)),
+            webhook_url=os.environ.get("WEBHOOK_URL"),
             secret_token=os.environ.get("SECRET_TOKEN"),
-            drop_pending_updates=True,  # Игнорируем обновления во время перезапуска
-            allowed_updates=[]  # Оптимизируем обработку обновлений
-        )
+            allowed_updates=ALLOWED_UPDATES,
+            health=health_status,
+        ))
     else:
-        application.run_polling()
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == '__main__':
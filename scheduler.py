@@ -0,0 +1,59 @@
+import heapq
+
+
+# ОЧЕРЕДЬ БЛИЖАЙШИХ НАПОМИНАНИЙ
+# Минимальная куча (дата, чат, строка задачи) в памяти: по ней проверка напоминаний знает, когда проснуться,
+# не обращаясь к базе. Актуальная дата каждой строки хранится в словаре; устаревшие записи кучи
+# не удаляются сразу, а пропускаются при чтении вершины
+class ReminderQueue:
+    def __init__(self):
+        self.heap = []
+        self.due = {}
+        self.chats = {}
+
+    def __len__(self):
+        return len(self.due)
+
+    # Полная загрузка из строк (id задачи, чат, дата напоминания)
+    def load(self, rows):
+        self.due = {}
+        self.chats = {}
+        for task_id, chat_id, next_reminder in rows:
+            self.due[task_id] = (next_reminder, chat_id)
+            self.chats.setdefault(chat_id, set()).add(task_id)
+        self._rebuild()
+
+    # Замена строк одного чата, например после регистрации или смены его настроек
+    def load_chat(self, chat_id, rows):
+        self.remove_chat(chat_id)
+        for task_id, next_reminder in rows:
+            self.update(task_id, chat_id, next_reminder)
+
+    def remove_chat(self, chat_id):
+        for task_id in self.chats.pop(chat_id, ()):
+            del self.due[task_id]
+        self._compact()
+
+    def update(self, task_id, chat_id, next_reminder):
+        self.due[task_id] = (next_reminder, chat_id)
+        self.chats.setdefault(chat_id, set()).add(task_id)
+        heapq.heappush(self.heap, (next_reminder, chat_id, task_id))
+        self._compact()
+
+    def nearest(self):
+        while self.heap:
+            next_reminder, chat_id, task_id = self.heap[0]
+            current = self.due.get(task_id)
+            if current is not None and current[0] == next_reminder:
+                return next_reminder
+            heapq.heappop(self.heap)
+        return None
+
+    def _rebuild(self):
+        self.heap = [(next_reminder, chat_id, task_id) for task_id, (next_reminder, chat_id) in self.due.items()]
+        heapq.heapify(self.heap)
+
+    # Куча пересобирается, когда устаревших записей становится больше актуальных
+    def _compact(self):
+        if len(self.heap) > 2 * len(self.due) + 64:
+            self._rebuild()
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from googleapiclient.errors import HttpError
+
+from metrics import Counter, Gauge, Histogram
+from quickstart import append_rows
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+BATCH_DELAY = 2
+# Не чаще одного запроса на запись в секунду: квота Sheets — 60 запросов в минуту на пользователя
+MIN_REQUEST_INTERVAL = 1
+BACKOFF_BASE = 5
+BACKOFF_MAX = 15 * 60
+
+EXPORT_SECONDS = Histogram('sheets_export_seconds', 'Время записи пачки статусов в Google Sheets')
+EXPORT_FAILURES = Counter('sheets_export_failures_total', 'Неудачные записи в Google Sheets по типу ошибки', ['error'])
+EXPORTED_ROWS = Counter('sheets_exported_rows_total', 'Строки статусов, выгруженные в Google Sheets')
+OUTBOX_DEPTH = Gauge('sheets_outbox_depth', 'Записи outbox, ожидающие выгрузки в Google Sheets')
+
+
+# ЗАДЕРЖКА ПЕРЕД ПОВТОРНОЙ ПОПЫТКОЙ
+def get_backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+# ПРЕВЫШЕНИЕ КВОТЫ ИЛИ ВРЕМЕННАЯ НЕДОСТУПНОСТЬ API
+def is_retryable(error):
+    if isinstance(error, HttpError):
+        return error.resp.status in (429, 500, 502, 503, 504)
+    return True
+
+
+# ФОНОВАЯ ВЫГРУЗКА СТАТУСОВ ИЗ OUTBOX В GOOGLE SHEETS ПАЧКАМИ
+class SheetsOutbox:
+    def __init__(self, db, writer=append_rows, batch_size=BATCH_SIZE, batch_delay=BATCH_DELAY):
+        self.db = db
+        self.writer = writer
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.wakeup = None
+        self.task = None
+
+    # СИГНАЛ ВОРКЕРУ О НОВЫХ ЗАПИСЯХ (НЕ БЛОКИРУЕТ ОБРАБОТЧИК)
+    def notify(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # Недоставленные записи остаются в таблице и будут выгружены после перезапуска
+
+    async def _wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # Ошибка базы не останавливает воркер: шаг повторяется с нарастающей паузой
+    async def run(self):
+        errors = 0
+        while True:
+            try:
+                await self._export_batch()
+                errors = 0
+            except Exception as e:
+                errors += 1
+                backoff = get_backoff(errors)
+                logger.error(f"Ошибка выгрузки outbox в Google Sheets: {e}, повтор через {backoff} с")
+                await asyncio.sleep(backoff)
+
+    async def _export_batch(self):
+        # Сигнал сбрасывается до чтения outbox: notify() во время запроса разбудит следующее ожидание
+        self.wakeup.clear()
+        rows, nearest, depth = await self.db.outbox_batch(datetime.now(timezone.utc), self.batch_size)
+        OUTBOX_DEPTH.set(depth)
+        if not rows:
+            timeout = None
+            if nearest is not None:
+                timeout = max((nearest - datetime.now(timezone.utc)).total_seconds(), 0)
+            await self._wait(timeout)
+            # Даём накопиться соседним изменениям, чтобы отправить их одним запросом
+            await asyncio.sleep(self.batch_delay)
+            return
+
+        try:
+            with EXPORT_SECONDS.time():
+                await asyncio.to_thread(self.writer, [list(row[1:5]) for row in rows])
+        except Exception as e:
+            EXPORT_FAILURES.inc(error=type(e).__name__)
+            now = datetime.now(timezone.utc)
+            if not is_retryable(e):
+                # Повтор не поможет: записи откладываются в sheets_outbox_failed
+                await self.db.outbox_failed([row[0] for row in rows], f"{type(e).__name__}: {e}", now)
+                logger.error(f"Google Sheets отклонил статусы ({len(rows)}), записи отложены: {e}")
+                return
+            await self.db.outbox_retry([
+                (row_id, attempts + 1, now + timedelta(seconds=get_backoff(attempts + 1)))
+                for row_id, *_, attempts in rows
+            ])
+            # Общая пауза, чтобы не упираться в квоту повторными запросами
+            backoff = get_backoff(min(row[-1] for row in rows) + 1)
+            logger.warning(f"Google Sheets недоступен ({e}), повтор через {backoff} с")
+            await asyncio.sleep(backoff)
+            return
+
+        await self.db.outbox_sent([row[0] for row in rows])
+        EXPORTED_ROWS.inc(len(rows))
+        OUTBOX_DEPTH.set(depth - len(rows))
+        logger.info(f"Статусы выгружены в Google Sheets: {len(rows)}")
+        await asyncio.sleep(MIN_REQUEST_INTERVAL)
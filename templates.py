@@ -0,0 +1,126 @@
+import threading
+
+import telegram
+
+MONTHS = {
+    1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля', 5: 'мая', 6: 'июня',
+    7: 'июля', 8: 'августа', 9: 'сентября', 10: 'октября', 11: 'ноября', 12: 'декабря'
+}
+
+# Максимальная длина текста сообщения в Telegram
+MESSAGE_LIMIT = 4096
+DIGEST_HEADER = "*🗂️НАПОМИНАНИЯ НА СЕГОДНЯ*\n\n"
+DIGEST_SEPARATOR = "\n\n"
+
+# Размеры страниц выбора специалиста: лимиты Telegram на клавиатуру не должны зависеть от размера справочника
+PAGE_SIZE = 8
+LETTERS_PER_ROW = 6
+
+
+# ПОЛУЧЕНИЕ СТРОКИ ИНТЕРВАЛА
+def get_interval_string(interval: int) -> str:
+    if interval == 1:
+        return "**1 день**"
+    elif 2 <= interval <= 4:
+        return f"**{interval} дня**"
+    else:
+        return f"**{interval} дней**"
+
+
+# ДАТА В ТЕКСТЕ СООБЩЕНИЯ
+def format_date(date) -> str:
+    return f"{date.day} {MONTHS[date.month]}"
+
+
+# СВОДКА НАПОМИНАНИЙ
+# Склеивает тексты напоминаний в сообщения не длиннее MESSAGE_LIMIT, разрезая только между напоминаниями.
+# Возвращает список (текст, номера напоминаний в нём)
+def build_digest(parts):
+    messages = []
+    text, indexes = DIGEST_HEADER, []
+    for index, part in enumerate(parts):
+        if indexes and len(text) + len(DIGEST_SEPARATOR) + len(part) > MESSAGE_LIMIT:
+            messages.append((text, indexes))
+            text, indexes = DIGEST_HEADER, []
+        text = f"{text}{DIGEST_SEPARATOR}{part}" if indexes else f"{text}{part}"
+        indexes.append(index)
+    if indexes:
+        messages.append((text, indexes))
+    return messages
+
+
+# КЭШ КЛАВИАТУР И ТЕКСТОВ СООБЩЕНИЙ
+# Всё, что зависит только от справочника, собирается один раз на версию справочника;
+# при отправке подставляется только дата
+class Templates:
+    def __init__(self, catalog_store):
+        self.catalog_store = catalog_store
+        self.lock = threading.Lock()
+        self.version = None
+        self.cache = {}
+
+    def _cached(self, key, build):
+        catalog = self.catalog_store.current
+        with self.lock:
+            if catalog.version != self.version:
+                self.cache = {}
+                self.version = catalog.version
+            value = self.cache.get(key)
+        if value is None:
+            value = build(catalog)
+            with self.lock:
+                if catalog.version == self.version:
+                    self.cache[key] = value
+        return value
+
+    # Без буквы — список букв (или сразу фамилии, если их не больше страницы), с буквой — страница фамилий
+    def specialists_keyboard(self, letter=None, page=0):
+        def build(catalog):
+            if letter is None and len(catalog.specialists) > PAGE_SIZE:
+                buttons = [
+                    telegram.InlineKeyboardButton(f"{key} ({len(group)})", callback_data=f"page:{key}:0")
+                    for key, group in catalog.by_letter.items()
+                ]
+                keyboard = [buttons[i:i + LETTERS_PER_ROW] for i in range(0, len(buttons), LETTERS_PER_ROW)]
+            else:
+                group = catalog.specialists if letter is None else catalog.by_letter.get(letter, ())
+                keyboard = [
+                    [telegram.InlineKeyboardButton(spec.surname, callback_data=f"specialist:{spec.surname}")]
+                    for spec in group[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+                ]
+                navigation = []
+                if page > 0:
+                    navigation.append(telegram.InlineKeyboardButton("◀️", callback_data=f"page:{letter}:{page - 1}"))
+                if letter is not None:
+                    navigation.append(telegram.InlineKeyboardButton("🔤 Буквы", callback_data="letters"))
+                if (page + 1) * PAGE_SIZE < len(group):
+                    navigation.append(telegram.InlineKeyboardButton("▶️", callback_data=f"page:{letter}:{page + 1}"))
+                if navigation:
+                    keyboard.append(navigation)
+            keyboard.append([telegram.InlineKeyboardButton("🔍 Поиск по фамилии", switch_inline_query_current_chat="")])
+            return telegram.InlineKeyboardMarkup(keyboard)
+        return self._cached(('keyboard', letter, page), build)
+
+    def reminder_list(self):
+        def build(catalog):
+            unique_tasks = {task.task.lower(): task for task in catalog.tasks}
+            lines = ["*СПИСОК ТВОИХ НАПОМИНАНИЙ и ГРАФИК ПРОВЕРКИ*\n\n"]
+            lines.extend(f"• {task.task.capitalize()} - {get_interval_string(task.interval_days)}\n"
+                         for task in unique_tasks.values())
+            return "".join(lines)
+        return self._cached('reminder_list', build)
+
+    def project_list(self, specialist):
+        return self._cached(('projects', specialist.surname), lambda catalog: "*ТВОИ ПРОЕКТЫ:*\n" + "\n".join(
+            f"{i + 1}. {project}" for i, project in enumerate(specialist.projects)
+        ))
+
+    # Заголовок напоминания зависит от задачи и набора проектов, дата добавляется при отправке
+    def reminder(self, task, projects, next_reminder) -> str:
+        projects = frozenset(projects)
+        header = self._cached(('reminder', task, projects), lambda catalog: "".join((
+            f"*📋ПОРА {task.upper()}*\n\n",
+            "\n".join(f"- {project}" for project in sorted(projects)),
+            "\n\n*⏰СЛЕДУЮЩИЙ РАЗ НАПОМНЮ ",
+        )))
+        return f"{header}{format_date(next_reminder)}*"
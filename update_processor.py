@@ -0,0 +1,56 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА ОБНОВЛЕНИЙ С СОХРАНЕНИЕМ ПОРЯДКА ДЛЯ КАЖДОГО ПОЛЬЗОВАТЕЛЯ
+# Обновления разных пользователей обрабатываются параллельно, одного пользователя — строго по очереди,
+# поэтому состояние ConversationHandler и user_data не гоняются между собой.
+# Число одновременно выполняемых обновлений ограничивает семафор, который берётся только после очереди
+# пользователя: ожидающие обновления одного пользователя не занимают места других. Поэтому
+# process_update переопределён — базовый класс взял бы общий семафор ещё до очереди пользователя
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # Семафор создаётся в initialize, уже в цикле событий приложения: в Python 3.9
+        # он привязывается к циклу при создании
+        self.running = None
+        self.queues = {}
+
+    @staticmethod
+    def _key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self.running:
+                await coroutine
+            return
+        # Для каждого пользователя — замок и число обновлений, которые его держат или ждут
+        entry = self.queues.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self.running:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.queues[key]
+
+    async def initialize(self):
+        if self.running is None:
+            self.running = asyncio.BoundedSemaphore(self.max_concurrent_updates)
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import logging
+import re
+import signal
+from urllib.parse import urlparse
+
+from telegram import Update
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+# ПРИЁМ ОБНОВЛЕНИЙ ОТ TELEGRAM
+# Обновление только кладётся в очередь приложения, поэтому ответ Telegram уходит сразу
+class TelegramHandler(RequestHandler):
+    def initialize(self, bot_application, secret_token):
+        self.bot_application = bot_application
+        self.secret_token = secret_token
+
+    async def post(self):
+        if self.secret_token and self.request.headers.get(SECRET_TOKEN_HEADER) != self.secret_token:
+            self.send_error(403)
+            return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.send_error(400)
+            return
+        await self.bot_application.update_queue.put(Update.de_json(data, self.bot_application.bot))
+
+
+# ПРОВЕРКА РАБОТОСПОСОБНОСТИ ДЛЯ ХОСТИНГА И МОНИТОРИНГА
+class HealthHandler(RequestHandler):
+    def initialize(self, health):
+        self.health = health
+
+    def get(self):
+        self.write(self.health())
+
+
+# ЗАПУСК БОТА ЗА СОБСТВЕННЫМ HTTP-СЕРВЕРОМ
+# Повторяет жизненный цикл Application.run_webhook (post_init, post_shutdown, остановка по сигналу),
+# но на том же порту отвечает и на проверку работоспособности
+async def run_webhook(application, listen, port, webhook_url, secret_token, allowed_updates, health):
+    path = urlparse(webhook_url).path or '/'
+    web_app = WebApplication([
+        (r'/health', HealthHandler, {'health': health}),
+        (re.escape(path), TelegramHandler, {'bot_application': application, 'secret_token': secret_token}),
+    ])
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.bot.set_webhook(webhook_url, secret_token=secret_token, allowed_updates=allowed_updates,
+                                      drop_pending_updates=True)
+    await application.start()
+    server = HTTPServer(web_app)
+    server.listen(port, listen)
+    logger.info(f"Webhook-сервер слушает {listen}:{port}, путь обновлений {path}")
+    try:
+        await stop_event.wait()
+    finally:
+        server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)